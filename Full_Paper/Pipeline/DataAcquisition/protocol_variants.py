@@ -0,0 +1,162 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+import numpy as np
+
+from pulse_protocol_generator import ProtocolSpec, render_protocol
+from waveform_templates import quantize
+
+# ==========================================================
+# PARAMETER GRID
+# ==========================================================
+
+def expand_grid(grid, base=None):
+    """
+    :param grid: {ProtocolSpec field: [values, ...]}, e.g.
+                 {"start_freq": [14000, 15000], "pulse_duration": [0.05, 0.10]}
+    :param base: ProtocolSpec the grid is applied to, DEFAULT: config.py values
+    :return: list of ProtocolSpec, one per combination (itertools.product order)
+    """
+    base = base or ProtocolSpec()
+    names = list(grid)
+    return [replace(base, **dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+# ==========================================================
+# VECTORIZED SYNTHESIS
+# ==========================================================
+# Variants sharing a sample count are synthesized as one (V, Ns) array.
+# float32 operands are combined in the same order as waveform_templates.tone()/
+# chirp(), so each row is sample-identical to the single-variant template.
+
+def _fade_window(Ns, fade_ms, sample_rate):
+    fade_samp = int(round(fade_ms * 1e-3 * sample_rate))
+    w = np.ones(Ns, dtype=np.float32)
+    if fade_samp == 0 or 2 * fade_samp >= Ns:
+        return w
+    w[:fade_samp]  = np.linspace(0.0, 1.0, fade_samp, dtype=np.float32)
+    w[-fade_samp:] = np.linspace(1.0, 0.0, fade_samp, dtype=np.float32)
+    return w
+
+def _column(values):
+    return np.asarray(values, dtype=np.float32)[:, None]
+
+def _group_by(specs, key):
+    groups = {}
+    for i, spec in enumerate(specs):
+        groups.setdefault(key(spec), []).append(i)
+    return groups
+
+def synthesize_pulses(specs):
+    """
+    :return: list of int16 faded chirp pulses, one per spec
+    """
+    pulses = [None] * len(specs)
+    groups = _group_by(specs, lambda s: (s.sample_rate, s.n_samples(s.pulse_duration), s.fade_ms))
+
+    for (sample_rate, Ns, fade_ms), idx in groups.items():
+        group = [specs[i] for i in idx]
+        t = np.arange(Ns, dtype=np.float32) / sample_rate
+
+        f0 = _column([s.start_freq for s in group])
+        half_k = _column([0.5 * ((s.end_freq - s.start_freq) / s.pulse_duration) for s in group])
+        amp = _column([s.amplitude for s in group])
+
+        phase = np.float32(2.0 * np.pi) * (f0 * t + half_k * t * t)
+        block = quantize(amp * np.sin(phase) * _fade_window(Ns, fade_ms, sample_rate))
+
+        for row, i in enumerate(idx):
+            pulses[i] = block[row]
+    return pulses
+
+def synthesize_beacons(specs):
+    """
+    :return: list of int16 faded beacon tones, one per spec
+    """
+    beacons = [None] * len(specs)
+    groups = _group_by(specs, lambda s: (s.sample_rate, s.n_samples(s.beacon_duration_sec), s.fade_ms))
+
+    for (sample_rate, Ns, fade_ms), idx in groups.items():
+        group = [specs[i] for i in idx]
+        t = np.arange(Ns, dtype=np.float32) / sample_rate
+
+        omega = _column([2.0 * np.pi * s.beacon_freq for s in group])
+        amp = _column([s.amplitude for s in group])
+
+        block = quantize(amp * np.sin(omega * t) * _fade_window(Ns, fade_ms, sample_rate))
+
+        for row, i in enumerate(idx):
+            beacons[i] = block[row]
+    return beacons
+
+# ==========================================================
+# PARALLEL RENDERING
+# ==========================================================
+
+def variant_name(index, spec):
+    return (f"variant{index:04d}_{spec.start_freq:g}-{spec.end_freq:g}Hz"
+            f"_p{spec.pulse_duration * 1e3:g}ms_g{spec.gap_duration * 1e3:g}ms"
+            f"_a{spec.amplitude:g}_b{spec.beacon_freq:g}Hz.wav")
+
+def _render_variant(args):
+    output_file, spec, beacon_pcm, cycle_pcm = args
+    n_written = render_protocol(output_file, spec, beacon_pcm=beacon_pcm, cycle_pcm=cycle_pcm)
+    return output_file, n_written
+
+def generate_variants(grid, output_dir, base=None, workers=None):
+    """
+    Synthesizes every grid combination at once, then renders the WAVs (and
+    their timeline manifests) from a process pool.
+
+    :param grid: see expand_grid()
+    :param output_dir: WAV/MANIFEST OUTPUT DIRECTORY
+    :param base: ProtocolSpec the grid is applied to
+    :param workers: PROCESS POOL SIZE, DEFAULT: os.cpu_count()
+    :return: list of {"file", "samples", "settings"} records (also written to variants.json)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    specs = expand_grid(grid, base)
+
+    pulses = synthesize_pulses(specs)
+    beacons = synthesize_beacons(specs)
+
+    jobs = []
+    for i, (spec, pulse, beacon) in enumerate(zip(specs, pulses, beacons)):
+        gap = np.zeros(spec.n_samples(spec.gap_duration), dtype=np.int16)
+        jobs.append((os.path.join(output_dir, variant_name(i, spec)), spec, beacon,
+                     np.concatenate([pulse, gap])))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        written = list(pool.map(_render_variant, jobs))
+
+    records = [{"file": os.path.basename(path), "samples": n, "settings": asdict(spec)}
+               for (path, n), spec in zip(written, specs)]
+    with open(os.path.join(output_dir, "variants.json"), "w") as f:
+        json.dump(records, f, indent=2)
+
+    return records
+
+# ==========================================================
+# MAIN
+# ==========================================================
+
+if __name__ == "__main__":
+    OUTPUT_DIR = "protocol_variants"
+
+    GRID = {
+        "start_freq": [14000.0, 15000.0, 16000.0],
+        "end_freq": [19200.0, 20000.0],
+        "pulse_duration": [0.05, 0.10],
+        "gap_duration": [0.05, 0.10],
+        "amplitude": [0.5, 0.85],
+        "beacon_freq": [8000, 10000],
+    }
+
+    t0 = time.perf_counter()
+    records = generate_variants(GRID, OUTPUT_DIR)
+    t1 = time.perf_counter()
+
+    print(f"Wrote {len(records)} variants to {OUTPUT_DIR} in {t1 - t0:.2f}s")
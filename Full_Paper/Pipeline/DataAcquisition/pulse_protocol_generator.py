@@ -1,111 +1,182 @@
 import numpy as np
 import wave
+import time
+import sys
+import os
+from dataclasses import dataclass, asdict
 
-# ==========================================================
-# USER SETTINGS
-# ==========================================================
-sample_rate = 48000
-
-# --- Alignment structure ---
-initial_silence_sec = 30.0
-beacon_freq           = 10000     # Hz (outside chirp band)
-beacon_duration_sec   = 2.0
-guard_silence_sec    = 1.5
-tail_silence_sec     = 5.0
-
-# --- Chirp pulse train ---
-pulse_duration = 0.10
-gap_duration   = 0.05
-start_freq     = 15000.0
-end_freq       = 19200.0
-amplitude      = 0.85
-fade_ms        = 5.0
-
-cycles_total   = 5
-active_secs    = 60.0
-
-output_file = f"{cycles_total}_15sPause_BeaconProtocol.wav"
+# config.py lives one level up (Full_Paper/Pipeline)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+import protocol_timeline
+from waveform_templates import beacon_template, chirp_template
 
 # ==========================================================
-# UTILITY FUNCTIONS
+# PROTOCOL SETTINGS (DEFAULTS FROM config.py)
 # ==========================================================
-def silence(sec):
-    return np.zeros(int(round(sec * sample_rate)), dtype=np.float32)
-
-def tone(freq, sec):
-    t = np.arange(int(round(sec * sample_rate)), dtype=np.float32) / sample_rate
-    return (amplitude * np.sin(2.0 * np.pi * freq * t)).astype(np.float32)
-
-def apply_fade(x, fade_ms):
-    fade_samp = int(round(fade_ms * 1e-3 * sample_rate))
-    if fade_samp == 0 or 2 * fade_samp >= x.size:
-        return x
-    w = np.ones_like(x)
-    w[:fade_samp]  = np.linspace(0.0, 1.0, fade_samp, dtype=np.float32)
-    w[-fade_samp:] = np.linspace(1.0, 0.0, fade_samp, dtype=np.float32)
-    return x * w
 
-# ==========================================================
-# BUILD BEGIN / END MARKERS
-# ==========================================================
-beacon_tone = apply_fade(tone(beacon_freq, beacon_duration_sec), fade_ms)
+@dataclass(frozen=True)
+class ProtocolSpec:
+    sample_rate: int = config.SAMPLE_RATE
 
-# ==========================================================
-# BUILD ONE CHIRP PULSE
-# ==========================================================
-Ns_pulse = int(round(sample_rate * pulse_duration))
-t = np.arange(Ns_pulse, dtype=np.float32) / sample_rate
+    # --- Alignment structure ---
+    initial_silence_sec: float = config.INITIAL_SILENCE_SEC
+    beacon_freq: float = config.BEACON_FREQ
+    beacon_duration_sec: float = config.BEACON_DURATION_SEC
+    guard_silence_sec: float = config.GUARD_SILENCE_SEC
+    tail_silence_sec: float = config.TAIL_SILENCE_SEC
 
-k = (end_freq - start_freq) / pulse_duration
-phase = 2.0 * np.pi * (start_freq * t + 0.5 * k * t * t)
-pulse = (amplitude * np.sin(phase)).astype(np.float32)
-pulse = apply_fade(pulse, fade_ms)
+    # --- Chirp pulse train ---
+    pulse_duration: float = config.PULSE_DURATION
+    gap_duration: float = config.GAP_DURATION
+    start_freq: float = config.START_FREQ
+    end_freq: float = config.END_FREQ
+    amplitude: float = config.AMPLITUDE
+    fade_ms: float = config.FADE_MS
 
-gap = silence(gap_duration)
-small_cycle = np.concatenate([pulse, gap])
+    cycles_total: int = config.CYCLES_TOTAL
+    active_secs: float = config.ACTIVE_SECS
+
+    def n_samples(self, sec):
+        return int(round(sec * self.sample_rate))
+
+# Number of samples written per wf.writeframes() call for silence and chirp blocks
+BLOCK_SAMPLES = 1 << 16
 
-# ==========================================================
-# BUILD ACTIVE CHIRP BLOCK
-# ==========================================================
-Ns_active = int(round(active_secs * sample_rate))
-cycles_in_block = Ns_active // small_cycle.size
-residual = Ns_active - cycles_in_block * small_cycle.size
+# ==========================================================
+# PRE-QUANTIZED BUILDING BLOCKS
+# ==========================================================
+
+# Faded tone/chirp templates come from the shared, memoized bank (waveform_templates.py)
+
+def build_beacon_pcm(spec):
+    return beacon_template(spec).pcm
+
+def build_cycle_pcm(spec):
+    # One small cycle = pulse + gap, quantized ONCE (pulse int16 is cached in the bank)
+    gap = np.zeros(spec.n_samples(spec.gap_duration), dtype=np.int16)
+    return np.concatenate([chirp_template(spec).pcm, gap])
+
+# ==========================================================
+# PROTOCOL LAYOUT
+# ==========================================================
+
+def protocol_layout(spec):
+    """
+    Ordered (kind, n_samples) sections of the protocol:
+    silence | beacon | guard | active x cycles_total | guard | beacon | tail
+    """
+    n_beacon = spec.n_samples(spec.beacon_duration_sec)
+    n_guard = spec.n_samples(spec.guard_silence_sec)
 
-active_block = np.concatenate(
-    [small_cycle] * cycles_in_block +
-    ([small_cycle[:residual]] if residual else [])
-)
+    return ([("silence", spec.n_samples(spec.initial_silence_sec)),
+             ("beacon", n_beacon),
+             ("guard", n_guard)] +
+            [("active", spec.n_samples(spec.active_secs))] * spec.cycles_total +
+            [("guard", n_guard),
+             ("beacon", n_beacon),
+             ("silence", spec.n_samples(spec.tail_silence_sec))])
 
-# Repeat active block cycles_total times
-chirps = np.concatenate([active_block] * cycles_total)
+def protocol_num_samples(spec):
+    return sum(n for _, n in protocol_layout(spec))
+
+def protocol_events(spec):
+    # Sample-exact beacon/guard/silence/pulse events (see protocol_timeline.py)
+    return protocol_timeline.build_timeline(protocol_layout(spec),
+                                            pulse_samples=spec.n_samples(spec.pulse_duration),
+                                            cycle_samples=spec.n_samples(spec.pulse_duration) +
+                                                          spec.n_samples(spec.gap_duration))
+
+# ==========================================================
+# STREAMING RENDERER
+# ==========================================================
+
+def _write_silence(wf, zero_bytes, n):
+    block = len(zero_bytes) // 2
+    for _ in range(n // block):
+        wf.writeframes(zero_bytes)
+    if n % block:
+        wf.writeframes(zero_bytes[:2 * (n % block)])
+
+def _write_active(wf, cycle_pcm, cycle_block_bytes, n):
+    # Whole pulse+gap cycles first (several per write), then the cycle remainder
+    Ns_cycle = cycle_pcm.size
+    cycles_per_write = len(cycle_block_bytes) // (2 * Ns_cycle)
+    cycles_in_block = n // Ns_cycle
+    residual = n - cycles_in_block * Ns_cycle
 
-# ==========================================================
-# ASSEMBLE FULL PROTOCOL
-# ==========================================================
-full_signal = np.concatenate([
-    silence(initial_silence_sec),
-    beacon_tone,
-    silence(guard_silence_sec),
-    chirps,
-    silence(guard_silence_sec),
-    beacon_tone,
-    silence(tail_silence_sec)
-])
+    for _ in range(cycles_in_block // cycles_per_write):
+        wf.writeframes(cycle_block_bytes)
+    remaining = cycles_in_block % cycles_per_write
+    if remaining:
+        wf.writeframes(cycle_block_bytes[:2 * remaining * Ns_cycle])
 
-# ==========================================================
-# WRITE WAV (INT16 PCM)
-# ==========================================================
-pcm = np.rint(np.clip(full_signal, -1.0, 1.0) * 32767.0).astype(np.int16)
+    # If active_secs isn't an exact multiple of pulse+gap, write the remainder
+    if residual:
+        wf.writeframes(cycle_pcm[:residual].tobytes())
+
+def render_protocol(output_file, spec=None, block_samples=BLOCK_SAMPLES,
+                    beacon_pcm=None, cycle_pcm=None, write_manifest=True):
+    """
+    Streams the protocol to a 16-bit mono WAV in fixed-size blocks.
+
+    Only the int16 beacon, one pulse+gap cycle tiled up to ~block_samples and
+    one block of zeros are ever held in memory, so peak memory does not depend
+    on cycles_total/active_secs. Output is sample-identical to quantizing the
+    fully concatenated float32 protocol.
+
+    :param output_file: WAV PATH
+    :param spec: ProtocolSpec, DEFAULT: config.py values
+    :param block_samples: SAMPLES PER WRITE
+    :param beacon_pcm: PRE-QUANTIZED BEACON (int16), built from spec if None
+    :param cycle_pcm: PRE-QUANTIZED PULSE+GAP CYCLE (int16), built from spec if None
+    :param write_manifest: WRITES <name>.timeline.json/.npy NEXT TO THE WAV
+    :return: total number of samples written
+    """
+    spec = spec or ProtocolSpec()
+    if beacon_pcm is None:
+        beacon_pcm = build_beacon_pcm(spec)
+    if cycle_pcm is None:
+        cycle_pcm = build_cycle_pcm(spec)
 
-with wave.open(output_file, "wb") as wf:
-    wf.setnchannels(1)
-    wf.setsampwidth(2)
-    wf.setframerate(sample_rate)
-    wf.writeframes(pcm.tobytes())
+    beacon_bytes = beacon_pcm.tobytes()
+    zero_bytes = bytes(2 * block_samples)
+    cycle_block_bytes = np.tile(cycle_pcm, max(1, block_samples // cycle_pcm.size)).tobytes()
 
-# ==========================================================
-# REPORT
-# ==========================================================
-total_duration = full_signal.size / sample_rate
-print(f"Wrote: {output_file}")
-print(f"Total duration: {total_duration:.2f} s ({total_duration/60:.2f} min)")
+    total = 0
+    with wave.open(output_file, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)        # 16-bit PCM
+        wf.setframerate(spec.sample_rate)
+
+        for kind, n in protocol_layout(spec):
+            if kind == "beacon":
+                wf.writeframes(beacon_bytes)
+            elif kind == "active":
+                _write_active(wf, cycle_pcm, cycle_block_bytes, n)
+            else:
+                _write_silence(wf, zero_bytes, n)
+            total += n
+
+    if write_manifest:
+        protocol_timeline.write_timeline(output_file, protocol_events(spec),
+                                         sample_rate=spec.sample_rate, settings=asdict(spec))
+
+    return total
+
+# ==========================================================
+# MAIN
+# ==========================================================
+
+if __name__ == "__main__":
+    spec = ProtocolSpec()
+    output_file = f"{spec.cycles_total}_15sPause_BeaconProtocol.wav"
+
+    t0 = time.perf_counter()
+    n_written = render_protocol(output_file, spec)
+    t1 = time.perf_counter()
+
+    total_duration = n_written / spec.sample_rate
+    print(f"Wrote: {output_file}")
+    print(f"Total duration: {total_duration:.2f} s ({total_duration/60:.2f} min)")
+    print(f"render: {t1 - t0:.3f}s")
@@ -0,0 +1,99 @@
+import json
+import os
+from dataclasses import asdict, dataclass, replace
+
+# ==========================================================
+# VIRTUAL CROPS (CROP RECORD INSTEAD OF A CROPPED VIDEO)
+# ==========================================================
+# Beacon detection writes a small crpd_<name>.crop.json next to where the
+# cropped video would have gone. Downstream stages (fast_split, STFT) seek
+# straight into the original recording: no encode pass, no intermediate
+# video written and read back.
+
+RECORD_SUFFIX = ".crop.json"
+
+@dataclass(frozen=True)
+class CropRecord:
+    source: str         # original (uncropped) video
+    start_sample: int   # first sample of the span, at sample_rate
+    end_sample: int     # one past the last sample
+    sample_rate: int = 48000
+    name: str = ""      # base name downstream outputs use, DEFAULT: crpd_<source name>
+
+    @classmethod
+    def from_times(cls, source, t_start, t_end, sample_rate=48000, name=None):
+        base = os.path.splitext(os.path.basename(source))[0]
+        return cls(source=source,
+                   start_sample=int(round(t_start * sample_rate)),
+                   end_sample=int(round(t_end * sample_rate)),
+                   sample_rate=int(sample_rate),
+                   name=name or "crpd_" + base)
+
+    @property
+    def t_start(self):
+        return self.start_sample / self.sample_rate
+
+    @property
+    def t_end(self):
+        return self.end_sample / self.sample_rate
+
+    @property
+    def duration(self):
+        return (self.end_sample - self.start_sample) / self.sample_rate
+
+    @property
+    def num_samples(self):
+        return self.end_sample - self.start_sample
+
+    def seek_args(self):
+        # ffmpeg input options (before -i) selecting the span
+        return ["-ss", f"{self.t_start:.6f}", "-to", f"{self.t_end:.6f}"]
+
+    def segments(self, segment_sec=2.0):
+        """
+        Splits the span on an exact segment_sec grid (fast_split's segment
+        muxer cuts at the next packet boundary, a few ms later).
+
+        :return: list of CropRecord named <name>_seg%03d (the last one may be shorter)
+        """
+        step = int(round(segment_sec * self.sample_rate))
+        return [replace(self, start_sample=s, end_sample=min(s + step, self.end_sample),
+                        name=f"{self.name}_seg{i:03d}")
+                for i, s in enumerate(range(self.start_sample, self.end_sample, step))]
+
+def record_path(output_dir, source):
+    base = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(output_dir, "crpd_" + base + RECORD_SUFFIX)
+
+def is_record_path(path):
+    return str(path).endswith(RECORD_SUFFIX)
+
+def save_record(record, path):
+    with open(path, "w") as f:
+        json.dump(asdict(record), f, indent=2)
+    return path
+
+def load_record(path):
+    with open(path) as f:
+        return CropRecord(**json.load(f))
+
+def as_record(item):
+    # CropRecord, path to a .crop.json, or None for anything else (plain media file)
+    if isinstance(item, CropRecord):
+        return item
+    if is_record_path(item):
+        return load_record(item)
+    return None
+
+def record_identity(item):
+    """
+    :param item: media file, or CropRecord / .crop.json
+    :return: (output name, file whose content is hashed, span or None, manifest
+             key or None): a crop record is its span of the source recording,
+             one StageManifest entry per span
+    """
+    record = as_record(item)
+    if record is None:
+        return os.path.splitext(os.path.basename(item))[0], item, None, None
+    return (record.name, record.source, [record.start_sample, record.end_sample],
+            f"{os.path.abspath(record.source)}#{record.name}")
@@ -1,44 +1,314 @@
 import subprocess, os
 import glob
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from crop_records import CropRecord, as_record, record_identity
+from frame_cropping import crop_files_tracked, in_frame_order
+from frame_store import video_crop_box
+from media_reader import probe_duration
+from stage_manifest import StageManifest
 
-def fast_split(video_path, out_audio_dir, out_frame_dir, skip_if_exists=True):
-    base = os.path.splitext(os.path.basename(video_path))[0]
-    audio_pattern = os.path.join(out_audio_dir, f"{base}_seg%03d.wav")
-    frame_pattern = os.path.join(out_frame_dir, f"{base}_frame%03d.jpg")
+SEGMENT_SEC = 2.0   # audio segment length == frame interval (fps=0.5)
 
+# Per-output ffmpeg options, shared by the two-pass and single-pass commands
+def _segment_output(audio_pattern, start_number=0):
+    return [
+        "-f", "segment", "-segment_time", f"{SEGMENT_SEC:g}",
+        "-segment_start_number", str(start_number),
+        "-ar", "48000", "-ac", "1",
+        "-c:a", "pcm_s16le",
+        audio_pattern
+    ]
+
+def _frame_output(frame_pattern, start_number=0, crop=None):
+    vf = f"fps={1.0 / SEGMENT_SEC:g}"
+    if crop is not None:
+        # After fps: only the kept frames are cropped. exact=1: no rounding of
+        # x/y down to the chroma grid, the box is used as given
+        x, y, w, h = crop
+        vf += f",crop={w}:{h}:{x}:{y}:exact=1"
+    return [
+        "-vf", vf,
+        "-start_number", str(start_number),
+        "-qscale:v", "2",
+        frame_pattern
+    ]
+
+def _already_split(out_audio_dir, out_frame_dir, base):
     # Simple existence check: if first segment + first frame exist, assume this video is done
-    first_seg  = os.path.join(out_audio_dir, f"{base}_seg000.wav")
-    first_frame = os.path.join(out_frame_dir, f"{base}_frame000.jpg")
+    return ((out_audio_dir is None or os.path.exists(os.path.join(out_audio_dir, f"{base}_seg000.wav")))
+            and (out_frame_dir is None or os.path.exists(os.path.join(out_frame_dir, f"{base}_frame000.jpg"))))
+
+def fast_split(video_path, out_audio_dir, out_frame_dir, skip_if_exists=True, single_pass=True,
+               threads=None, start_number=0, crop=None):
+    """
+    :param video_path: video file, or a CropRecord / .crop.json: the span is
+                       then read straight from the original recording
+    :param out_audio_dir, out_frame_dir: None -> that output is not written
+                                         (e.g. audio kept in a segment store)
+    :param single_pass: True -> one ffmpeg run, the input is demuxed once and
+                        feeds both the audio segments and the frames (same bytes
+                        as the two separate runs of single_pass=False)
+    :param threads: ffmpeg -threads, None -> ffmpeg default (all cores)
+    :param start_number: index of the first segment/frame (shards of a longer span)
+    :param crop: (x, y, w, h) -> frames are cropped by ffmpeg before the JPEG encode
+    :return: "ok", or "skipped" if the outputs already exist
+    """
+    record = as_record(video_path)
+    if record is not None:
+        base = record.name
+        video_path = record.source
+        seek = record.seek_args()   # input seek: only the span is decoded
+    else:
+        base = os.path.splitext(os.path.basename(video_path))[0]
+        seek = []
+
+    if skip_if_exists and _already_split(out_audio_dir, out_frame_dir, base):
+        print(f"[SKIP] {video_path} already split.")
+        return "skipped"
+
+    cmd = ["ffmpeg", "-y", "-nostdin"]
+    if threads is not None:
+        cmd += ["-threads", str(threads)]
+    cmd += [*seek, "-i", video_path]
+
+    outputs = []
+    if out_audio_dir is not None:
+        audio_pattern = os.path.join(out_audio_dir, f"{base}_seg%03d.wav")
+        outputs.append(["-map", "0:a:0", *_segment_output(audio_pattern, start_number)])
+    if out_frame_dir is not None:
+        frame_pattern = os.path.join(out_frame_dir, f"{base}_frame%03d.jpg")
+        outputs.append(["-map", "0:v:0", *_frame_output(frame_pattern, start_number, crop)])
+    if not outputs:
+        return "skipped"
+
+    if single_pass:
+        # One input, mapped outputs: audio segments + frames
+        subprocess.run(cmd + [arg for output in outputs for arg in output], check=True)
+        return "ok"
+
+    # Audio segments, then frame extraction
+    for output in outputs:
+        subprocess.run(cmd + output, check=True)
+    return "ok"
+
+def fast_split_cropped(video_path, out_audio_dir, out_frame_dir, chunk=None, skip_if_exists=True,
+                       single_pass=True, threads=None, samples=3):
+    """
+    fast_split() writing cell crops instead of full frames (the output of
+    frame_cropping.crop_all_images, named like fast_split frames).
+
+    The box is detected on 'samples' frames (frame_store.video_crop_box); if
+    they agree, ffmpeg crops during extraction and no full-size frame is
+    ever written. Otherwise the full frames are cropped in place afterwards,
+    one tracked box per frame (frame_cropping.crop_files_tracked).
+
+    :param chunk: frame_cropping 'chunk' margin around the cell box
+    :return: "ok" or "skipped"
+    """
+    if out_frame_dir is None:
+        return fast_split(video_path, out_audio_dir, None, skip_if_exists, single_pass, threads)
+
+    record = as_record(video_path)
+    base = record.name if record is not None else os.path.splitext(os.path.basename(video_path))[0]
+    if skip_if_exists and _already_split(out_audio_dir, out_frame_dir, base):
+        print(f"[SKIP] {video_path} already split.")
+        return "skipped"
+
+    box = video_crop_box(video_path, chunk, samples=samples, threads=threads)
+    fast_split(video_path, out_audio_dir, out_frame_dir, skip_if_exists=False, single_pass=single_pass,
+               threads=threads, crop=box)
+    if box is not None:
+        return "ok"
+
+    print(f"[UPDATE]: NO STABLE CELL BOX IN {video_path}, CROPPING FRAME BY FRAME")
+    frames = in_frame_order(glob.glob(os.path.join(glob.escape(out_frame_dir), f"{glob.escape(base)}_frame[0-9][0-9][0-9]*.jpg")))
+    for result in crop_files_tracked(frames, chunk=chunk, overwrite_file=True):
+        if result["status"] != "ok":
+            print(f"[ERROR]: {result['file']} {result['status'].upper()} {result.get('error', '')}")
+    return "ok"
+
+# ==========================================================
+# ONE LONG VIDEO (TIME-RANGE SHARDS)
+# ==========================================================
+# The span is cut on the SEGMENT_SEC grid into contiguous ranges, each split
+# by its own ffmpeg (-ss/-to input seek) with -segment_start_number /
+# -start_number offsets, so file names and indices match a serial run.
+
+def shard_ranges(video_path, shards):
+    """
+    :return: list of (CropRecord span, first segment index), grid-aligned
+    """
+    record = as_record(video_path)
+    if record is None:
+        duration = probe_duration(video_path)
+        if duration is None:
+            raise RuntimeError(f"Cannot probe duration of {video_path}")
+        base = os.path.splitext(os.path.basename(video_path))[0]
+        record = CropRecord.from_times(video_path, 0.0, duration, name=base)
+
+    step = int(round(SEGMENT_SEC * record.sample_rate))
+    n_segments = math.ceil(record.num_samples / step)
+    per_shard = math.ceil(n_segments / max(1, min(shards, n_segments)))
+
+    ranges = []
+    for first in range(0, n_segments, per_shard):
+        start = record.start_sample + first * step
+        end = min(start + per_shard * step, record.end_sample)
+        ranges.append((replace(record, start_sample=start, end_sample=end), first))
+    return ranges
 
-    if skip_if_exists and os.path.exists(first_seg) and os.path.exists(first_frame):
+def fast_split_sharded(video_path, out_audio_dir, out_frame_dir, shards=None, threads_per_shard=None,
+                       skip_if_exists=True, crop=None):
+    """
+    fast_split() of one video (or crop record) as 'shards' concurrent
+    time ranges. Segments are cut at packet boundaries inside each range,
+    so their lengths may differ from a serial run by a few ms; indices and
+    frames match.
+
+    :param shards: CONCURRENT RANGES, DEFAULT: os.cpu_count()
+    :param threads_per_shard: ffmpeg -threads each, DEFAULT: cores // shards
+    :param crop: (x, y, w, h) box cropped by ffmpeg, as fast_split()
+    :return: "ok" or "skipped"
+    """
+    record = as_record(video_path)
+    base = record.name if record is not None else os.path.splitext(os.path.basename(video_path))[0]
+    if skip_if_exists and _already_split(out_audio_dir, out_frame_dir, base):
         print(f"[SKIP] {video_path} already split.")
-        return
-
-    # Audio segments
-    subprocess.run(
-        [
-            "ffmpeg", "-y",
-            "-i", video_path,
-            "-f", "segment", "-segment_time", "2",
-            "-ar", "48000", "-ac", "1",
-            "-c:a", "pcm_s16le",
-            audio_pattern
-        ],
-        check=True
-    )
-
-    # Frame extraction
-    subprocess.run(
-        [
-            "ffmpeg", "-y",
-            "-i", video_path,
-            "-vf", "fps=0.5",
-            "-start_number", "0",
-            "-qscale:v", "2",
-            frame_pattern
-        ],
-        check=True
-    )
+        return "skipped"
+
+    cores = os.cpu_count() or 1
+    ranges = shard_ranges(video_path, shards or cores)
+    threads = threads_per_shard or max(1, cores // len(ranges))
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = [pool.submit(fast_split, span, out_audio_dir, out_frame_dir, False, True, threads, first, crop)
+                   for span, first in ranges]
+        for future in futures:
+            future.result()
+    return "ok"
+
+# ==========================================================
+# MANIFEST (INCREMENTAL RERUNS)
+# ==========================================================
+
+# Everything the written segments/frames depend on
+SPLIT_PARAMS = {
+    "segment_sec": SEGMENT_SEC,
+    "sample_rate": 48000,
+    "channels": 1,
+    "frame_fps": 1.0 / SEGMENT_SEC,
+    "frame_qscale": 2,
+}
+
+def split_manifest(path):
+    return StageManifest(path, "fast_split", SPLIT_PARAMS)
+
+def split_outputs(out_audio_dir, out_frame_dir, base):
+    outputs = []
+    if out_audio_dir is not None:
+        outputs += glob.glob(os.path.join(glob.escape(out_audio_dir), f"{glob.escape(base)}_seg[0-9][0-9][0-9]*.wav"))
+    if out_frame_dir is not None:
+        outputs += glob.glob(os.path.join(glob.escape(out_frame_dir), f"{glob.escape(base)}_frame[0-9][0-9][0-9]*.jpg"))
+    return outputs
+
+def fast_split_incremental(video_path, out_audio_dir, out_frame_dir, manifest, single_pass=True,
+                           threads=None, crop_frames=False, chunk=None):
+    """
+    fast_split() driven by a StageManifest instead of the first-file check:
+    reruns when the input content or the split parameters changed, or when
+    outputs of the last run are missing; stale outputs are deleted first.
+
+    :param crop_frames: True -> fast_split_cropped() with 'chunk'
+
+    :return: "ok" or "skipped"
+    """
+    base, source, span, key = record_identity(video_path)
+    extra = {"span": span} if span else None
+    if crop_frames:
+        extra = {**(extra or {}), "frame_crop": True, "crop_chunk": chunk}
+    if out_audio_dir is None or out_frame_dir is None:
+        # Entries of full splits stay valid; a skipped output is a different run
+        extra = {**(extra or {}), "audio": out_audio_dir is not None, "frames": out_frame_dir is not None}
+    needed, reason = manifest.needs_run(source, extra, key)
+    if not needed:
+        return "skipped"
+
+    manifest.invalidate(source, key)
+    for path in split_outputs(out_audio_dir, out_frame_dir, base):
+        os.remove(path)   # partial or stale files of an interrupted / older run
+
+    if crop_frames:
+        fast_split_cropped(video_path, out_audio_dir, out_frame_dir, chunk, skip_if_exists=False,
+                           single_pass=single_pass, threads=threads)
+    else:
+        fast_split(video_path, out_audio_dir, out_frame_dir, skip_if_exists=False,
+                   single_pass=single_pass, threads=threads)
+    manifest.record(source, split_outputs(out_audio_dir, out_frame_dir, base), extra, key)
+    manifest.checkpoint()
+    return "ok"
+
+# ==========================================================
+# MANY VIDEOS (THREAD POOL OF FFMPEG PROCESSES)
+# ==========================================================
+# The work happens in ffmpeg subprocesses, so threads are enough to keep
+# several running. Each gets cores // workers decoder threads, so the pool
+# as a whole never oversubscribes the machine.
+
+def _split_one(video_path, out_audio_dir, out_frame_dir, skip_if_exists, single_pass, threads, manifest,
+               crop_frames, chunk):
+    record = {"video": str(video_path), "status": "ok"}
+    t0 = time.perf_counter()
+    try:
+        if manifest is not None:
+            record["status"] = fast_split_incremental(video_path, out_audio_dir, out_frame_dir, manifest,
+                                                      single_pass, threads, crop_frames, chunk)
+        elif crop_frames:
+            record["status"] = fast_split_cropped(video_path, out_audio_dir, out_frame_dir, chunk,
+                                                  skip_if_exists, single_pass, threads)
+        else:
+            record["status"] = fast_split(video_path, out_audio_dir, out_frame_dir, skip_if_exists,
+                                          single_pass, threads)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = round(time.perf_counter() - t0, 3)
+    return record
+
+def split_many(videos, out_audio_dir, out_frame_dir, workers=None, threads_per_worker=None,
+               skip_if_exists=True, single_pass=True, manifest_path=None, crop_frames=False, chunk=None):
+    """
+    fast_split() of many videos (or crop records) concurrently, never raises.
+
+    :param workers: CONCURRENT FFMPEG PROCESSES, DEFAULT: min(len(videos), cores // 2)
+    :param threads_per_worker: ffmpeg -threads each, DEFAULT: cores // workers
+    :param out_audio_dir, out_frame_dir: None -> that output is not written
+    :param manifest_path: StageManifest JSON -> incremental reruns (replaces skip_if_exists)
+    :param crop_frames: True -> frames are cell crops (fast_split_cropped, 'chunk' margin)
+    :return: list of {"video", "status", "seconds", ["error"]} in completion order
+    """
+    cores = os.cpu_count() or 1
+    workers = workers or max(1, min(len(videos), cores // 2))
+    threads = threads_per_worker or max(1, cores // workers)
+
+    for out_dir in (out_audio_dir, out_frame_dir):
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+    manifest = split_manifest(manifest_path) if manifest_path else None
+
+    records = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_split_one, video, out_audio_dir, out_frame_dir, skip_if_exists,
+                               single_pass, threads, manifest, crop_frames, chunk) for video in videos]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            print(f"[{record['status'].upper()}] {record['video']} ({record['seconds']:.1f}s)")
+
+    if manifest is not None:
+        manifest.save()
+    return records
 
 if __name__ == "__main__":
 
@@ -48,8 +318,8 @@ if __name__ == "__main__":
 
     raw_video_files = glob.glob(RAW_VIDEOS_DIR + "/*")
 
-    for video_file in raw_video_files:
-
-        fast_split(video_path=video_file,
-                   out_audio_dir=AUDIO_SEGMENTS_DIR,
-                   out_frame_dir=VIDEO_FRAMES_DIR)
+    records = split_many(raw_video_files,
+                         out_audio_dir=AUDIO_SEGMENTS_DIR,
+                         out_frame_dir=VIDEO_FRAMES_DIR)
+    failed = sum(r["status"] == "error" for r in records)
+    print(f"Done: {len(records) - failed} ok, {failed} failed.")
@@ -1,31 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 import numpy as np
 import glob
+import os
 import cv2
 
-def crop_cell_from_frames(image_path: str,
-                          output_dir: str = None,
-                          chunk: int = None,
-                          overwrite_file: bool = False,
-                          verbose: bool = False):
+# Define the lower and upper blue HSV --> Hue, Saturation, Value
+LOWER_BLUE = np.array([90, 50, 50])
+UPPER_BLUE = np.array([130, 255, 255])
 
-    # Checks for output_dir or overwrite_file
-    if not output_dir and not overwrite_file:
-        print("[ERROR]: OUTPUT DIRECTORY MUST BE PROVIDED OR ORIGINAL FILE OVERWRITTEN")
-        return None
+def expand_box(box, chunk: int = None):
+    # Increases the contour box by chunk // 2 on each side
+    x, y, w, h = box
+    if chunk:
+        xy = chunk // 2
+        x, y, w, h = x-xy, y-xy, w+chunk, h+chunk
+    return x, y, w, h
 
-    # Reads image file
-    img = cv2.imread(image_path)
+def find_cell_box(img: np.ndarray, chunk: int = None):
+    """
+    :param img: BGR uint8 frame
+    :param chunk: EXTRA PIXELS AROUND THE BOX (chunk // 2 on each side)
+    :return: (x, y, w, h) of the largest blue contour, None if there is none
+    """
 
     # Converts from RGB/BGR to HSV
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
 
-    # Define the lower and upper blue HSV --> Hue, Saturation, Value
-    lower_blue = np.array([90, 50, 50])
-    upper_blue = np.array([130, 255, 255])
-
     # Applies binary, color-based mask on the HSV image
-    mask = cv2.inRange(hsv, lower_blue, upper_blue)
+    mask = cv2.inRange(hsv, LOWER_BLUE, UPPER_BLUE)
 
     # Removes further image noise using median blur, 5x5 grid
     mask = cv2.medianBlur(mask, 5)
@@ -34,61 +37,362 @@ def crop_cell_from_frames(image_path: str,
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     if not contours:
-        print(f"[ERROR]: NO BLUE CONTOUR FOUND\nFRAME: {image_path}")
         return None
 
     # Finds largest contour
     contour = max(contours, key=cv2.contourArea)
 
     # Gets contour bounding box
-    x, y, w, h = cv2.boundingRect(contour)
+    return expand_box(cv2.boundingRect(contour), chunk)
 
-    if chunk:
-        xy = chunk // 2
+# ==========================================================
+# PYRAMID DETECTION (COARSE BOX, FULL-RESOLUTION EDGES)
+# ==========================================================
+# The largest blue region is found on a 1/scale copy of the frame, then
+# each of its four edges is re-measured on a thin full-resolution band
+# around the coarse edge (same HSV range and 5x5 median as find_cell_box),
+# so only ~4 strips of the full frame are ever converted to HSV.
 
-        # Increases the contour
-        x, y, w, h = x-xy, y-xy, w+chunk, h+chunk
+MEDIAN_PAD = 2   # 5x5 median: context needed around a band for exact results
+
+def _blue_mask(img, x0, y0, x1, y1):
+    # find_cell_box()'s mask restricted to [y0:y1, x0:x1], identical to the
+    # same window of the full-frame mask (median context taken from the frame)
+    H, W = img.shape[:2]
+    px0, py0 = max(x0 - MEDIAN_PAD, 0), max(y0 - MEDIAN_PAD, 0)
+    px1, py1 = min(x1 + MEDIAN_PAD, W), min(y1 + MEDIAN_PAD, H)
+    hsv = cv2.cvtColor(img[py0:py1, px0:px1], cv2.COLOR_BGR2HSV)
+    mask = cv2.medianBlur(cv2.inRange(hsv, LOWER_BLUE, UPPER_BLUE), 5)
+    return mask[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+def find_cell_box_pyramid(img: np.ndarray, chunk: int = None, scale: int = 4, refine: bool = True):
+    """
+    find_cell_box() on a 1/scale image, edges refined at full resolution.
+
+    :param scale: DOWNSCALE FACTOR (4 or 8 for 4K frames)
+    :param refine: False -> coarse box scaled back up (± scale pixels)
+    :return: (x, y, w, h) or None
+    """
+    H, W = img.shape[:2]
+    small = cv2.resize(img, (max(1, W // scale), max(1, H // scale)), interpolation=cv2.INTER_AREA)
+
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    mask = cv2.medianBlur(cv2.inRange(hsv, LOWER_BLUE, UPPER_BLUE), 3)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    xs, ys, ws, hs = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    fx, fy = W / small.shape[1], H / small.shape[0]
+    x0, y0 = int(xs * fx), int(ys * fy)
+    x1, y1 = min(int(np.ceil((xs + ws) * fx)), W), min(int(np.ceil((ys + hs) * fy)), H)
+    if not refine:
+        return expand_box((x0, y0, x1 - x0, y1 - y0), chunk)
+
+    # Each edge lies within ~one coarse pixel of its coarse position: search a band of
+    # +-m rows/columns around it, spanning the coarse extent of the other axis (+-m)
+    m = 2 * scale
+    bx0, bx1 = max(x0 - m, 0), min(x1 + m, W)
+    by0, by1 = max(y0 - m, 0), min(y1 + m, H)
+
+    def edge(band_mask, axis, inner, last):
+        # Only blobs touching the band's inner line (inside the cell) belong to the
+        # largest contour; other blue blobs within the band are separate contours
+        _, labels = cv2.connectedComponents(band_mask, connectivity=8)
+        line = labels[inner] if axis == 1 else labels[:, inner]
+        hits = np.flatnonzero(np.isin(labels, line[line > 0]).any(axis=axis))
+        if hits.size == 0:
+            return None
+        return hits[-1] if last else hits[0]
+
+    top = edge(_blue_mask(img, bx0, by0, bx1, min(y0 + m, H)), axis=1, inner=-1, last=False)
+    bottom = edge(_blue_mask(img, bx0, max(y1 - m, 0), bx1, by1), axis=1, inner=0, last=True)
+    left = edge(_blue_mask(img, bx0, by0, min(x0 + m, W), by1), axis=0, inner=-1, last=False)
+    right = edge(_blue_mask(img, max(x1 - m, 0), by0, bx1, by1), axis=0, inner=0, last=True)
+
+    x = bx0 + left if left is not None else x0
+    y = by0 + top if top is not None else y0
+    xe = max(x1 - m, 0) + right + 1 if right is not None else x1
+    ye = max(y1 - m, 0) + bottom + 1 if bottom is not None else y1
+    return expand_box((int(x), int(y), int(xe - x), int(ye - y)), chunk)
+
+def detect_cell_box(img: np.ndarray, chunk: int = None, scale: int = None):
+    # scale None / 1 -> find_cell_box(), otherwise find_cell_box_pyramid()
+    if not scale or scale == 1:
+        return find_cell_box(img, chunk)
+    return find_cell_box_pyramid(img, chunk, scale=scale)
+
+def crop_cell(img: np.ndarray, chunk: int = None):
+    """
+    In-memory crop of the cell (largest blue contour), None if not found.
+    """
+    box = find_cell_box(img, chunk)
+    if box is None:
+        return None
+    x, y, w, h = box
+    return img[y:y+h, x:x+w]
+
+# ==========================================================
+# CROP-BOX TRACKING (ONE VIDEO'S FRAMES)
+# ==========================================================
+# The cell holder barely moves within a recording: the box found on the
+# first frame is reused while a cheap check on a subsampled grid still
+# holds, i.e. the blue ratio inside the box stays close to the one measured
+# at detection and the ring just outside it does not turn blue (the cell
+# moved or grew). Only then is the full find_cell_box() run again.
+
+def blue_ratio(img: np.ndarray, box, step: int = 4):
+    """
+    :return: fraction of blue pixels (LOWER_BLUE..UPPER_BLUE) in 'box' (clipped
+             to the frame), sampled every 'step' pixels; 0.0 for an empty box
+    """
+    x, y, w, h = box
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, img.shape[1]), min(y + h, img.shape[0])
+    patch = img[y0:y1:step, x0:x1:step]
+    if patch.size == 0:
+        return 0.0
+    hsv = cv2.cvtColor(np.ascontiguousarray(patch), cv2.COLOR_BGR2HSV)
+    return float(np.count_nonzero(cv2.inRange(hsv, LOWER_BLUE, UPPER_BLUE))) / (hsv.shape[0] * hsv.shape[1])
+
+class CellBoxTracker:
+    """
+    :param chunk: margin added to the returned box, as find_cell_box()
+    :param tolerance: ALLOWED DROP OF THE INNER BLUE RATIO (relative to detection)
+    :param ring: WIDTH (pixels) OF THE BAND AROUND THE BOX CHECKED FOR DRIFT
+    :param max_ring_increase: rise of the ring blue ratio (relative to detection)
+                              above which the cell is assumed to have moved
+    :param scale: DETECTION DOWNSCALE FACTOR (detect_cell_box), None -> full resolution
+    """
+
+    def __init__(self, chunk: int = None, tolerance: float = 0.15, ring: int = 8,
+                 max_ring_increase: float = 0.2, scale: int = None):
+        self.chunk = chunk
+        self.scale = scale
+        self.tolerance = tolerance
+        self.ring = ring
+        self.max_ring_increase = max_ring_increase
+        self.raw_box = None        # detected box without the chunk margin
+        self.reference = None      # (inner, ring) blue ratios at detection
+        self.detections = 0
+
+    def _ring_ratio(self, img, box):
+        x, y, w, h = box
+        r = self.ring
+        bands = [(x - r, y - r, w + 2 * r, r), (x - r, y + h, w + 2 * r, r),
+                 (x - r, y, r, h), (x + w, y, r, h)]
+        return max(blue_ratio(img, band, step=2) for band in bands)
 
+    def _still_valid(self, img):
+        inner, ring = self.reference
+        return (blue_ratio(img, self.raw_box) >= inner * (1.0 - self.tolerance)
+                and self._ring_ratio(img, self.raw_box) <= ring + self.max_ring_increase)
+
+    def update(self, img: np.ndarray):
+        """
+        :return: (box with chunk margin or None, True if a full detection ran)
+        """
+        if self.raw_box is not None and self._still_valid(img):
+            return expand_box(self.raw_box, self.chunk), False
+
+        self.detections += 1
+        self.raw_box = detect_cell_box(img, scale=self.scale)
+        if self.raw_box is None:
+            self.reference = None
+            return None, True
+        self.reference = (blue_ratio(img, self.raw_box), self._ring_ratio(img, self.raw_box))
+        return expand_box(self.raw_box, self.chunk), True
+
+def _save_crop(img, box, image_path, output_dir, overwrite_file, result):
     # Crops original image
+    x, y, w, h = box
     crop = img[y:y+h, x:x+w]
 
-    # Saves the cropped file
     if overwrite_file: # Overwrites original image file
-
-        # Saves crop
-        cv2.imwrite(image_path, crop)
-        if verbose:
-            print(f"{image_path} Overwritten Successfully!")
+        output_path = image_path
     else: # Creates new file
+        output_path = output_dir + "/cropped_" + (image_path.split('/')[-1])
+
+    # Saves crop
+    if not cv2.imwrite(output_path, crop):
+        raise IOError(f"Cannot write crop {output_path}")
+    result.update(output=output_path, box=[int(v) for v in box])
+
+def _read(image_path):
+    # Reads image file
+    img = cv2.imread(image_path)
+    if img is None:
+        raise IOError(f"Cannot read image {image_path}")
+    return img
+
+def crop_file(image_path: str,
+              output_dir: str = None,
+              chunk: int = None,
+              overwrite_file: bool = False,
+              scale: int = None):
+    """
+    imread -> crop_cell -> imwrite of one frame, never prints or raises.
+
+    :param scale: DETECTION DOWNSCALE FACTOR (detect_cell_box), None -> full resolution
+
+    :return: {"file", "status": "ok" | "no_contour" | "error", "output", "box", ["error"]}
+    """
+    result = {"file": image_path, "status": "ok", "output": None, "box": None}
+    try:
+        img = _read(image_path)
+        box = detect_cell_box(img, chunk, scale)
+        if box is None:
+            result["status"] = "no_contour"
+            return result
+        _save_crop(img, box, image_path, output_dir, overwrite_file, result)
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    return result
+
+def crop_files_tracked(image_paths: list,
+                       output_dir: str = None,
+                       chunk: int = None,
+                       overwrite_file: bool = False,
+                       scale: int = None,
+                       **tracker_kwargs):
+    """
+    crop_file() for the frames of ONE video, in order, sharing a CellBoxTracker.
+
+    :return: list of crop_file()-style results, plus "redetected" per frame
+    """
+    tracker = CellBoxTracker(chunk=chunk, scale=scale, **tracker_kwargs)
+    results = []
+    for image_path in image_paths:
+        result = {"file": image_path, "status": "ok", "output": None, "box": None}
+        try:
+            img = _read(image_path)
+            box, result["redetected"] = tracker.update(img)
+            if box is None:
+                result["status"] = "no_contour"
+            else:
+                _save_crop(img, box, image_path, output_dir, overwrite_file, result)
+        except Exception as e:
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+        results.append(result)
+    return results
+
+def video_of(frame_path: str):
+    # <video>_frame%03d.jpg -> <video> (fast_split naming)
+    return os.path.basename(frame_path).rsplit("_frame", 1)[0]
+
+def frame_index(frame_path: str):
+    # <video>_frame%03d.jpg -> frame number, None for other names
+    stem = os.path.splitext(os.path.basename(frame_path))[0]
+    _, sep, number = stem.rpartition("_frame")
+    return int(number) if sep and number.isdigit() else None
+
+def in_frame_order(frame_paths):
+    # Time order: %03d grows past 3 digits after frame 999, where name order puts _frame1000 before _frame101
+    def key(path):
+        index = frame_index(path)
+        return (index is None, index or 0, path)
+    return sorted(frame_paths, key=key)
+
+def crop_cell_from_frames(image_path: str,
+                          output_dir: str = None,
+                          chunk: int = None,
+                          overwrite_file: bool = False,
+                          verbose: bool = False):
+
+    # Checks for output_dir or overwrite_file
+    if not output_dir and not overwrite_file:
+        print("[ERROR]: OUTPUT DIRECTORY MUST BE PROVIDED OR ORIGINAL FILE OVERWRITTEN")
+        return None
+
+    _report(crop_file(image_path, output_dir, chunk, overwrite_file), overwrite_file, verbose)
+
+def _report(result, overwrite_file, verbose):
+    # Failures are always printed, successes only when verbose
+    if result["status"] == "no_contour":
+        print(f"[ERROR]: NO BLUE CONTOUR FOUND\nFRAME: {result['file']}")
+    elif result["status"] == "error":
+        print(f"[ERROR]: {result['error']}")
+    elif verbose:
+        if overwrite_file:
+            print(f"{result['file']} Overwritten Successfully!")
+        else:
+            print(f"CROP SAVED AT {result['output']}")
 
-        # Gets crop file name
-        crop_output_path = output_dir + "/cropped_" + (image_path.split('/')[-1])
+def _crop_job(args):
+    return crop_file(*args)
 
-        # Saves crop
-        cv2.imwrite(crop_output_path, crop)
-        if verbose:
-            print(f"CROP SAVED AT {crop_output_path}")
+def _tracked_job(args):
+    return crop_files_tracked(*args)
 
 def crop_all_images(extracted_frames_dir: str,
                     output_dir: str = None,
                     chunk: int = None,
                     overwrite_file: bool = False,
-                    verbose: bool = False):
+                    verbose: bool = False,
+                    workers: int = None,
+                    executor: str = "thread",
+                    track: bool = False,
+                    scale: int = None):
+    """
+    Crops every frame of a directory in parallel.
+
+    :param workers: POOL SIZE, DEFAULT: os.cpu_count(); 1 -> serial, in this process
+    :param executor: "thread" (OpenCV releases the GIL in imread/cvtColor/
+                     findContours/imwrite) or "process"
+    :param track: True -> one job per video (fast_split frame names), whose frames
+                  reuse the first detected box while CellBoxTracker validates it
+    :param scale: detect on a 1/scale image with full-resolution edges
+                  (find_cell_box_pyramid, same boxes), DEFAULT: full resolution
+    :return: list of crop_file() results, in file order
+    """
+
+    # Checks for output_dir or overwrite_file
+    if not output_dir and not overwrite_file:
+        print("[ERROR]: OUTPUT DIRECTORY MUST BE PROVIDED OR ORIGINAL FILE OVERWRITTEN")
+        return None
 
     # Sets the entire path
     full_path = extracted_frames_dir + "/*"
 
     # Lists all image files
-    files = glob.glob(full_path)
+    files = sorted(glob.glob(full_path))
 
     # Checks for files
     if not files:
         print("[ERROR]: EXTRACTED FRAMES DIRECTORY IS EMPTY!")
         return None
 
-    for file_path in tqdm(files):
-        crop_cell_from_frames(image_path=file_path, output_dir=output_dir,
-                              chunk=chunk, overwrite_file=overwrite_file, verbose=verbose)
+    workers = workers or os.cpu_count() or 1
+    if track:
+        videos = {}
+        for file_path in files:
+            videos.setdefault(video_of(file_path), []).append(file_path)
+        jobs = [(in_frame_order(paths), output_dir, chunk, overwrite_file, scale) for paths in videos.values()]
+        job_fn = _tracked_job
+    else:
+        jobs = [(file_path, output_dir, chunk, overwrite_file, scale) for file_path in files]
+        job_fn = _crop_job
+
+    if workers == 1:
+        results = [job_fn(job) for job in tqdm(jobs)]
+    else:
+        pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        with pool_cls(max_workers=workers) as pool:
+            # map() keeps file order; the progress bar advances as results arrive in order
+            chunksize = max(1, len(jobs) // (16 * workers)) if executor == "process" else 1
+            results = list(tqdm(pool.map(job_fn, jobs, chunksize=chunksize), total=len(jobs)))
+
+    if track:
+        order = {file_path: i for i, file_path in enumerate(files)}
+        results = sorted((r for video in results for r in video), key=lambda r: order[r["file"]])
+
+    # Printed once the pool is done, so the lines do not interleave with tqdm
+    for result in results:
+        _report(result, overwrite_file, verbose)
+    failed = sum(result["status"] != "ok" for result in results)
+    if failed:
+        print(f"[ERROR]: {failed} OF {len(results)} FRAMES NOT CROPPED")
+    return results
 
 
 if __name__ == "__main__":
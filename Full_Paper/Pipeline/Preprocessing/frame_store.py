@@ -0,0 +1,416 @@
+import json
+import os
+import subprocess
+import cv2
+import numpy as np
+
+from crop_records import as_record, record_identity
+from frame_cropping import detect_cell_box, expand_box
+from media_reader import finish_pipe, kill_pipe, open_pipe, probe_duration
+from stage_manifest import StageManifest
+
+# ==========================================================
+# FRAME STORE (UINT8 FRAME STACK + INDEX, NO JPEGS)
+# ==========================================================
+# ffmpeg decodes the fps=0.5 frames of fast_split into a rawvideo BGR pipe;
+# each frame is optionally cropped to the cell (frame_cropping.detect_cell_box,
+# in memory) and resized, then appended to one fixed-shape stack:
+#   <store>.frames     raw uint8, shape (N, H, W, 3), BGR like cv2.imread()
+#   <store>.index.npy  one row per frame (video id, frame index, time, crop box,
+#                      position in the stack)
+#   <store>.json       frame shape, fps, crop settings, video names
+# Readers memory-map the stack: store[i] is a zero-copy (H, W, 3) view of
+# stack frame index[i]["slot"].
+# No JPEG encode in fast_split, no decode/re-encode in the crop step.
+# update_store() only decodes new or changed recordings (StageManifest) and
+# appends them, as segment_store.update_store() does for audio; a replaced
+# recording's old frames stay in the stack, unreferenced by the index.
+
+FRAME_FPS = 0.5   # same frame grid as fast_split (one frame per audio segment)
+
+INDEX_DTYPE = np.dtype([
+    ("video", np.int32),     # position in manifest["videos"]
+    ("frame", np.int32),     # index within the recording (_frame%03d)
+    ("time", np.float64),    # seconds from the start of the recording / crop span
+    ("x", np.int32),         # crop box in the decoded frame (w == 0: no cell found,
+    ("y", np.int32),         # frame stored as zeros; without cropping the
+    ("w", np.int32),         # box is the whole frame)
+    ("h", np.int32),
+    ("slot", np.int64),      # frame position in <store>.frames
+])
+
+def _with_slots(index):
+    # Stores written before the "slot" column: row i is stack frame i
+    if "slot" in index.dtype.names:
+        return index
+    rows = np.zeros(index.size, dtype=INDEX_DTYPE)
+    for field in index.dtype.names:
+        rows[field] = index[field]
+    rows["slot"] = np.arange(index.size)
+    return rows
+
+def store_paths(path):
+    base = path[:-len(".json")] if path.endswith(".json") else path
+    return base + ".frames", base + ".index.npy", base + ".json"
+
+def probe_frame_size(video_path):
+    """
+    :return: (width, height) of decoded frames, rotation metadata applied
+             (ffmpeg autorotates phone videos on decode)
+    """
+    out = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height:stream_side_data=rotation",
+            "-of", "json",
+            video_path
+        ],
+        capture_output=True, check=True, text=True
+    ).stdout
+    stream = json.loads(out)["streams"][0]
+    width, height = stream["width"], stream["height"]
+    rotation = next((int(sd["rotation"]) for sd in stream.get("side_data_list", []) if "rotation" in sd), 0)
+    if rotation % 180:
+        width, height = height, width
+    return width, height
+
+def iter_frames(video_path, fps=FRAME_FPS, start=None, duration=None, threads=None):
+    """
+    Decoded BGR frames (uint8, (H, W, 3)) at 'fps', streamed from an ffmpeg
+    rawvideo pipe. The SAME buffer is refilled for every frame: copy a frame
+    if it must outlive the next iteration.
+    """
+    width, height = probe_frame_size(video_path)
+
+    cmd = ["ffmpeg", "-nostdin", "-v", "error"]
+    if threads is not None:
+        cmd += ["-threads", str(threads)]
+    if start:
+        cmd += ["-ss", f"{start:.6f}"]
+    cmd += ["-i", video_path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-map", "0:v:0", "-vf", f"fps={fps:g}", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+
+    proc = open_pipe(cmd)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    view = memoryview(frame).cast("B")
+    try:
+        while True:
+            n_bytes = 0
+            while n_bytes < frame.nbytes:
+                n = proc.stdout.readinto(view[n_bytes:])
+                if not n:
+                    break
+                n_bytes += n
+            if n_bytes < frame.nbytes:
+                break
+            yield frame
+    except GeneratorExit:
+        kill_pipe(proc)
+        raise
+
+    finish_pipe(proc, cmd)
+
+def read_frame(video_path, t, threads=None):
+    """
+    :return: the BGR frame shown at 't' seconds (uint8, (H, W, 3)), None past the end
+    """
+    width, height = probe_frame_size(video_path)
+    cmd = ["ffmpeg", "-nostdin", "-v", "error"]
+    if threads is not None:
+        cmd += ["-threads", str(threads)]
+    cmd += ["-ss", f"{t:.6f}", "-i", video_path,
+            "-map", "0:v:0", "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    if len(out) < width * height * 3:
+        return None
+    return np.frombuffer(out, dtype=np.uint8, count=width * height * 3).reshape(height, width, 3)
+
+# ==========================================================
+# ONE CROP BOX PER VIDEO (FFMPEG-SIDE CROPPING)
+# ==========================================================
+# On a fixed rig the cell box is the same in every frame: detect it on a few
+# frames spread over the recording, and if they agree let ffmpeg crop=
+# during frame extraction (fast_split(crop=...)) instead of writing
+# full-size JPEGs and cropping them afterwards.
+
+def video_crop_box(video_path, chunk=None, samples=3, max_shift=8, scale=None, threads=None):
+    """
+    :param video_path: video file, or a CropRecord / .crop.json (frames of its span)
+    :param samples: FRAMES DETECTED, evenly spread over the recording
+    :param max_shift: largest disagreement (pixels, any edge) between the sample boxes
+    :param scale: detection downscale factor (frame_cropping.detect_cell_box)
+    :return: (x, y, w, h) covering every sample box plus 'chunk', clipped to the
+             frame; None if a sample has no cell or the boxes disagree (rig moved)
+    """
+    record = as_record(video_path)
+    if record is not None:
+        source, t_start, duration = record.source, record.t_start, record.duration
+    else:
+        source, t_start, duration = video_path, 0.0, probe_duration(video_path)
+        if duration is None:
+            raise RuntimeError(f"Cannot probe duration of {video_path}")
+
+    edges = []
+    for k in range(samples):
+        img = read_frame(source, t_start + (k + 0.5) * duration / samples, threads=threads)
+        box = detect_cell_box(img, scale=scale) if img is not None else None
+        if box is None:
+            return None
+        x, y, w, h = box
+        edges.append((x, y, x + w, y + h))
+
+    edges = np.array(edges)
+    if np.ptp(edges, axis=0).max() > max_shift:
+        return None
+    x0, y0 = edges[:, :2].min(axis=0)
+    x1, y1 = edges[:, 2:].max(axis=0)
+    x, y, w, h = expand_box((int(x0), int(y0), int(x1 - x0), int(y1 - y0)), chunk)
+
+    # ffmpeg's crop filter fails on boxes past the frame edge
+    width, height = img.shape[1], img.shape[0]
+    x0, y0 = max(x, 0), max(y, 0)
+    return x0, y0, min(x + w, width) - x0, min(y + h, height) - y0
+
+# ==========================================================
+# WRITER
+# ==========================================================
+
+class FrameStoreWriter:
+    """
+    Appends the frames of many videos to one stack; index and manifest are
+    written by close().
+
+    :param size: (width, height) of stored frames; None -> decoded size of the
+                 first video (later videos are resized to it)
+    :param crop: True -> crop to the cell first (then 'size' is required,
+                 crops differ in size)
+    :param chunk: frame_cropping 'chunk' margin around the cell box
+    :param scale: cell detection downscale factor (frame_cropping.detect_cell_box)
+    :param append: True -> continue an existing store written with the same
+                   size, crop, chunk and fps instead of truncating it
+    """
+
+    def __init__(self, path, size=None, crop=False, chunk=None, fps=FRAME_FPS, scale=None, append=False):
+        if crop and size is None:
+            raise ValueError("A fixed 'size' is required when cropping")
+        self.frames_path, self.index_path, self.manifest_path = store_paths(path)
+        self.size = tuple(size) if size is not None else None
+        self.crop = crop
+        self.chunk = chunk
+        self.scale = scale
+        self.fps = fps
+        self.videos = []
+        self.sources = []
+        self._rows = []
+        self._n_frames = 0
+
+        if append and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            height, width, _ = manifest["shape"]
+            stored = ((width, height) if manifest["num_frames"] else self.size, manifest["crop"],
+                      manifest["chunk"], manifest["fps"])
+            if stored != (self.size or stored[0], crop, chunk, fps):
+                raise ValueError(f"{self.manifest_path} holds another frame size / crop / fps")
+            self.size = stored[0]
+            self.videos = manifest["videos"]
+            self.sources = manifest.get("sources", [None] * len(self.videos))
+            self._rows = [_with_slots(np.load(self.index_path))]
+            self._n_frames = manifest["num_frames"]
+            self._out = open(self.frames_path, "r+b" if os.path.exists(self.frames_path) else "wb")
+            if self.size is not None:
+                # drop frames of an interrupted writer
+                self._out.truncate(self._n_frames * self.size[0] * self.size[1] * 3)
+            self._out.seek(0, os.SEEK_END)
+        else:
+            self._out = open(self.frames_path, "wb")
+
+    def _fit(self, img):
+        if img.shape[1] == self.size[0] and img.shape[0] == self.size[1]:
+            return img
+        return cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
+
+    def remove(self, name):
+        """
+        Drops the rows of recording 'name' (its frames stay in <store>.frames,
+        unreferenced); the name can then be added again.
+
+        :return: number of frames removed
+        """
+        if name not in self.videos:
+            return 0
+        video = self.videos.index(name)
+        self.videos[video] = None
+        self.sources[video] = None
+        rows = np.concatenate(self._rows) if self._rows else np.zeros(0, dtype=INDEX_DTYPE)
+        keep = rows["video"] != video
+        self._rows = [rows[keep]]
+        return int((~keep).sum())
+
+    def add_frames(self, name, frames, source=None):
+        """
+        :param frames: iterable of BGR uint8 frames (e.g. iter_frames())
+        :param source: JSON-serializable origin of the frames (kept in the manifest)
+        :return: number of frames added
+        """
+        self.remove(name)
+        video = len(self.videos)
+        self.videos.append(name)
+        self.sources.append(source)
+        rows = []
+
+        for i, img in enumerate(frames):
+            if self.size is None:
+                self.size = (img.shape[1], img.shape[0])
+
+            if self.crop:
+                box = detect_cell_box(img, self.chunk, self.scale)
+                if box is None:
+                    out = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+                    box = (0, 0, 0, 0)
+                else:
+                    # chunk margin may reach past the frame edge: clip (negative
+                    # slice starts would wrap around)
+                    x, y, w, h = box
+                    x0, y0 = max(x, 0), max(y, 0)
+                    x1, y1 = min(x + w, img.shape[1]), min(y + h, img.shape[0])
+                    box = (x0, y0, x1 - x0, y1 - y0)
+                    out = self._fit(img[y0:y1, x0:x1])
+            else:
+                box = (0, 0, img.shape[1], img.shape[0])
+                out = self._fit(img)
+
+            np.ascontiguousarray(out).tofile(self._out)
+            rows.append((video, i, i / self.fps, *box, self._n_frames))
+            self._n_frames += 1
+
+        self._rows.append(np.array(rows, dtype=INDEX_DTYPE))
+        return len(rows)
+
+    def add_video(self, video_path, threads=None):
+        """
+        Decodes a video (or the span of a crop record) straight into the store.
+        """
+        name, source, span, _ = record_identity(video_path)
+        record = as_record(video_path)
+        if record is not None:
+            frames = iter_frames(record.source, self.fps, start=record.t_start, duration=record.duration,
+                                 threads=threads)
+        else:
+            frames = iter_frames(video_path, self.fps, threads=threads)
+        return self.add_frames(name, frames, source={"path": os.path.abspath(source), "span": span})
+
+    def close(self):
+        self._out.close()
+        index = np.concatenate(self._rows) if self._rows else np.zeros(0, dtype=INDEX_DTYPE)
+        np.save(self.index_path, index)
+        width, height = self.size or (0, 0)
+        with open(self.manifest_path, "w") as f:
+            json.dump({
+                "num_frames": self._n_frames,
+                "shape": [height, width, 3],
+                "color": "bgr",
+                "fps": self.fps,
+                "crop": self.crop,
+                "chunk": self.chunk,
+                "videos": self.videos,
+                "sources": self.sources,
+            }, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def update_store(path, videos, size=None, crop=False, chunk=None, fps=FRAME_FPS, scale=None,
+                 manifest_path=None, threads=None, progress=None):
+    """
+    Brings the store at 'path' up to date with 'videos' (files or crop
+    records): new or changed recordings are decoded and appended, a changed
+    one replaces its older copy. A missing store, or one written with other
+    settings, is rebuilt from scratch.
+
+    :param manifest_path: StageManifest JSON, DEFAULT: <store>.stage.json
+    :param progress: optional wrapper around the video iterable (e.g. tqdm)
+    :return: names of the (re)added recordings
+    """
+    manifest_path = manifest_path or os.path.splitext(store_paths(path)[2])[0] + ".stage.json"
+    manifest = StageManifest(manifest_path, "frame_store",
+                             {"size": size, "crop": crop, "chunk": chunk, "fps": fps, "scale": scale})
+
+    try:
+        writer = FrameStoreWriter(path, size, crop, chunk, fps, scale, append=True)
+        if not os.path.exists(store_paths(path)[2]):
+            manifest.entries.clear()
+    except ValueError:
+        writer = FrameStoreWriter(path, size, crop, chunk, fps, scale)
+        manifest.entries.clear()
+
+    added = []
+    with writer:
+        for video in (progress(videos) if progress else videos):
+            name, source, span, key = record_identity(video)
+            extra = {"span": span} if span else None
+            if name in writer.videos and not manifest.needs_run(source, extra, key)[0]:
+                continue
+            writer.add_video(video, threads=threads)
+            manifest.record(source, [], extra, key)
+            added.append(name)
+    # Entries are saved only once the index lists their rows
+    manifest.save()
+    return added
+
+# ==========================================================
+# READER
+# ==========================================================
+
+class FrameStore:
+    """
+    Read-only view of a store. store[i] is frame i as a zero-copy (H, W, 3)
+    uint8 memmap slice; store.index holds the matching rows.
+    """
+
+    def __init__(self, path):
+        frames_path, index_path, manifest_path = store_paths(path)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self.videos = self.manifest["videos"]
+        self.sources = self.manifest.get("sources", [None] * len(self.videos))
+        self.index = _with_slots(np.load(index_path))
+        shape = (self.manifest["num_frames"], *self.manifest["shape"])
+        if shape[0]:
+            self.frames = np.memmap(frames_path, dtype=np.uint8, mode="r", shape=shape)
+        else:
+            self.frames = np.zeros(shape, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.frames[self.index[i]["slot"]]
+
+    @property
+    def found(self):
+        # False where cropping found no cell (stored frame is all zeros)
+        return self.index["w"] > 0
+
+    def name(self, i):
+        # <video>_frame%03d, the file name fast_split would have used
+        row = self.index[i]
+        return f"{self.videos[row['video']]}_frame{row['frame']:03d}"
+
+    def frames_of(self, video):
+        """
+        :param video: name or id
+        :return: (n, H, W, 3) zero-copy view of that recording's frames
+        """
+        vid = self.videos.index(video) if isinstance(video, str) else video
+        slots = self.index["slot"][self.index["video"] == vid]
+        if slots.size == 0:
+            return self.frames[:0]
+        # add_frames() writes a recording's frames back to back
+        return self.frames[slots[0]:slots[-1] + 1]
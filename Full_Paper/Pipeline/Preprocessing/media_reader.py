@@ -0,0 +1,174 @@
+import json
+import math
+import subprocess
+import threading
+from collections import deque
+import numpy as np
+
+# ==========================================================
+# IN-MEMORY AUDIO DECODING (FFMPEG PIPE → NUMPY)
+# ==========================================================
+# Raw s16le PCM is streamed from an ffmpeg subprocess straight into
+# preallocated int16 buffers with readinto(): no temporary WAV, no extra copy.
+# PCM stays int16 until to_float32() is called.
+# stderr is drained by a thread while stdout is read: a damaged file logging
+# one error per packet can not fill the stderr pipe and stall ffmpeg.
+
+SAMPLE_RATE = 48000
+STDERR_LINES = 200   # last ffmpeg log lines kept for the error message
+
+def probe_duration(path):
+    """
+    :return: container duration in seconds, None if ffprobe is unavailable or fails
+    """
+    try:
+        out = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "json",
+                path
+            ],
+            capture_output=True, check=True, text=True
+        ).stdout
+        return float(json.loads(out)["format"]["duration"])
+    except (OSError, subprocess.CalledProcessError, KeyError, ValueError):
+        return None
+
+def _ffmpeg_pcm_cmd(path, sample_rate, channels, start, duration, threads):
+    cmd = ["ffmpeg", "-nostdin", "-v", "error"]
+    if threads is not None:
+        cmd += ["-threads", str(threads)]
+    if start:
+        cmd += ["-ss", f"{start:.6f}"]   # input seek
+    cmd += ["-i", path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += [
+        "-vn",                    # remove video stream
+        "-ac", str(channels),
+        "-ar", str(sample_rate),
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "pipe:1"
+    ]
+    return cmd
+
+def _drain(stream, lines):
+    for line in stream:
+        lines.append(line)
+
+def open_pipe(cmd):
+    """
+    Starts 'cmd' with stdout as an unbuffered pipe; stderr is collected by a
+    background thread (see finish_pipe / kill_pipe).
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    proc.stderr_lines = deque(maxlen=STDERR_LINES)
+    proc.stderr_thread = threading.Thread(target=_drain, args=(proc.stderr, proc.stderr_lines), daemon=True)
+    proc.stderr_thread.start()
+    return proc
+
+def finish_pipe(proc, cmd):
+    # After stdout hit EOF: raises CalledProcessError (with the log tail) on failure
+    proc.stdout.close()
+    returncode = proc.wait()
+    proc.stderr_thread.join()
+    proc.stderr.close()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=b"".join(proc.stderr_lines))
+
+def kill_pipe(proc):
+    # Reader stopped early (generator closed)
+    proc.kill()
+    proc.stdout.close()
+    proc.wait()
+    proc.stderr_thread.join()
+    proc.stderr.close()
+
+def read_audio(path, sample_rate=SAMPLE_RATE, start=None, duration=None,
+               channels=1, threads=None):
+    """
+    Decodes the audio of any ffmpeg-readable file (video or audio).
+
+    :param path: MEDIA FILE
+    :param sample_rate: OUTPUT SAMPLE RATE (ffmpeg resamples)
+    :param start: WINDOW START (seconds), None -> from the beginning
+    :param duration: WINDOW LENGTH (seconds), None -> to the end
+    :param channels: OUTPUT CHANNELS (1 = mono downmix)
+    :param threads: ffmpeg -threads, None -> ffmpeg default
+    :return: int16 array, shape (n,) for mono or (n, channels)
+    """
+    # Preallocate from the requested window or the probed duration (+1 s slack)
+    if duration is None:
+        total = probe_duration(path)
+        seconds = (total - (start or 0.0) + 1.0) if total else 60.0
+    else:
+        seconds = duration
+    capacity = max(1, math.ceil(seconds * sample_rate)) * channels
+
+    cmd = _ffmpeg_pcm_cmd(path, sample_rate, channels, start, duration, threads)
+    proc = open_pipe(cmd)
+
+    buf = np.empty(capacity, dtype=np.int16)
+    n_bytes = 0
+    while True:
+        if n_bytes == buf.nbytes:
+            # Probe under-estimated (or unavailable): grow geometrically
+            grown = np.empty(2 * buf.size, dtype=np.int16)
+            grown[:buf.size] = buf
+            buf = grown
+        n = proc.stdout.readinto(memoryview(buf).cast("B")[n_bytes:])
+        if not n:
+            break
+        n_bytes += n
+
+    finish_pipe(proc, cmd)
+
+    pcm = buf[:n_bytes // 2]
+    if channels > 1:
+        pcm = pcm[:pcm.size - pcm.size % channels].reshape(-1, channels)
+    return pcm
+
+def iter_audio_blocks(path, block_samples, sample_rate=SAMPLE_RATE, start=None,
+                      duration=None, channels=1, threads=None):
+    """
+    Streams decoded audio in fixed-size int16 blocks (the last one may be shorter).
+
+    The SAME buffer is refilled for every block: copy a block if it must
+    outlive the next iteration.
+    """
+    cmd = _ffmpeg_pcm_cmd(path, sample_rate, channels, start, duration, threads)
+    proc = open_pipe(cmd)
+
+    buf = np.empty(block_samples * channels, dtype=np.int16)
+    view = memoryview(buf).cast("B")
+    try:
+        while True:
+            n_bytes = 0
+            while n_bytes < buf.nbytes:
+                n = proc.stdout.readinto(view[n_bytes:])
+                if not n:
+                    break
+                n_bytes += n
+
+            n_samples = n_bytes // (2 * channels)
+            if n_samples:
+                block = buf[:n_samples * channels]
+                yield block.reshape(-1, channels) if channels > 1 else block
+            if n_bytes < buf.nbytes:
+                break
+    except GeneratorExit:
+        kill_pipe(proc)
+        raise
+
+    finish_pipe(proc, cmd)
+
+def to_float32(pcm, normalize=True):
+    """
+    :param normalize: True -> [-1, 1) like librosa/soundfile, False -> raw int16 values
+    """
+    x = pcm.astype(np.float32)
+    if normalize:
+        x /= 32768.0
+    return x
@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+Benchmarks and parity checks for the preprocessing pipeline.
+
+Each subcommand times an optimized path against the existing one on the
+same input and checks that both agree. The exit status is non-zero when a
+parity check fails.
+
+Example:
+    python3 pipeline_benchmark.py beacon --minutes 3 --repeats 3
+    python3 pipeline_benchmark.py chirps --minutes 3
+    python3 pipeline_benchmark.py crop --seconds 60 --gop 2
+    python3 pipeline_benchmark.py split --seconds 120
+    python3 pipeline_benchmark.py detect --frames 20 --scale 4
+    python3 pipeline_benchmark.py framecrop --seconds 60
+    python3 pipeline_benchmark.py store --frames 40
+    python3 pipeline_benchmark.py stft --minutes 2
+    python3 pipeline_benchmark.py recording --minutes 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from dataclasses import replace
+
+import cv2
+import numpy as np
+
+# DataAcquisition (protocol generator) sits next to Preprocessing
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DataAcquisition"))
+
+import fast_split
+import frame_cropping
+import frame_store
+import protocol_cropping
+import protocol_timeline
+import recording_spectrogram
+import segment_store
+import smart_cut
+import stft_batch
+import stft_fft_librosa
+import video_cropping
+from pulse_protocol_generator import ProtocolSpec, render_protocol
+
+
+# ----------------------------
+# Utilities
+# ----------------------------
+
+def time_call(fn, repeats):
+    """Best-of-'repeats' wall time and the result of the last call."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def synthetic_recording(minutes, lead_sec=7.3, noise_rms=300.0, seed=0):
+    """
+    Protocol played into a noisy 'recording' that starts lead_sec early.
+
+    :return: (int16 pcm, sample_rate, timeline events shifted to recording samples)
+    """
+    base = ProtocolSpec()
+    spec = replace(base, cycles_total=max(1, int(round(minutes * 60.0 / base.active_secs))))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "protocol.wav")
+        render_protocol(path, spec)
+        with wave.open(path, "rb") as wf:
+            protocol = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        _, events = protocol_timeline.load_timeline(path)
+
+    sr = spec.sample_rate
+    rng = np.random.default_rng(seed)
+    lead = np.zeros(int(round(lead_sec * sr)), dtype=np.float32)
+    tail = np.zeros(3 * sr, dtype=np.float32)
+
+    rec = np.concatenate([lead, protocol.astype(np.float32), tail])
+    rec += rng.normal(0.0, noise_rms, rec.size).astype(np.float32)
+    events["start"] += lead.size
+    return np.clip(np.rint(rec), -32768, 32767).astype(np.int16), sr, events
+
+
+def report(name, rows, checks):
+    print(f"\n=== {name} ===")
+    for row in rows:
+        print(json.dumps(row))
+    ok = all(passed for _, passed in checks)
+    for label, passed in checks:
+        print(f"[{'PASS' if passed else 'FAIL'}] {label}")
+    return ok
+
+
+# ----------------------------
+# Beacon detection
+# ----------------------------
+
+def bench_beacon(args):
+    pcm, sr, _ = synthetic_recording(args.minutes, seed=args.seed)
+    audio = pcm.astype(np.float32)
+    hop = protocol_cropping.NARROWBAND_HOP
+
+    t_full, ref = time_call(lambda: protocol_cropping.detect_beacons(audio, sr, plot=False), args.repeats)
+    t_narrow, nb = time_call(lambda: protocol_cropping.detect_beacons_narrowband(audio, sr, hop), args.repeats)
+
+    diff_hops = np.abs(np.subtract(ref, nb)) * sr / hop
+    rows = [
+        {"detector": "full", "seconds": round(t_full, 4), "t_start": ref[0], "t_end": ref[1]},
+        {"detector": "narrowband", "seconds": round(t_narrow, 4), "t_start": nb[0], "t_end": nb[1],
+         "speedup": round(t_full / t_narrow, 1), "diff_hops": diff_hops.round(3).tolist()},
+    ]
+    checks = [(f"narrowband within one hop ({hop} samples) of detect_beacons", bool(np.all(diff_hops <= 1.0)))]
+    return report(f"beacon detection ({args.minutes} min @ {sr} Hz)", rows, checks)
+
+
+# ----------------------------
+# Chirp detection
+# ----------------------------
+
+def onset_errors(times, sr, truth):
+    """Signed error (samples) of each detection against its nearest true pulse start."""
+    if len(times) == 0:
+        return np.zeros(0)
+    samples = np.asarray(times) * sr
+    nearest = np.clip(np.searchsorted(truth, samples), 1, len(truth) - 1)
+    left, right = truth[nearest - 1], truth[nearest]
+    return np.where(samples - left < right - samples, samples - left, samples - right)
+
+
+def bench_chirps(args):
+    pcm, sr, events = synthetic_recording(args.minutes, seed=args.seed)
+    truth = protocol_timeline.events_of(events, "pulse")["start"].astype(np.float64)
+
+    detectors = {
+        "flux": lambda: video_cropping.detect_chirps(pcm, sr=sr),
+        "coarse_fine": lambda: video_cropping.detect_chirps_coarse_fine(pcm, sr=sr),
+        "matched": lambda: video_cropping.detect_chirps_matched(pcm, sr=sr)[0],
+    }
+
+    rows = []
+    for name, fn in detectors.items():
+        seconds, times = time_call(fn, args.repeats)
+        err = onset_errors(times, sr, truth)
+        # Constant offsets (fade-in, detector delay) cancel in alignment: report spread around the median
+        spread = float(np.max(np.abs(err - np.median(err)))) if err.size else None
+        rows.append({"detector": name, "seconds": round(seconds, 4), "found": int(len(times)),
+                     "expected": int(truth.size),
+                     "median_offset_samples": round(float(np.median(err)), 3) if err.size else None,
+                     "max_jitter_samples": round(spread, 3) if spread is not None else None})
+
+    matched = rows[-1]
+    checks = [("matched filter finds every pulse", matched["found"] == truth.size),
+              ("matched filter onsets within 0.5 sample", matched["max_jitter_samples"] is not None
+               and abs(matched["median_offset_samples"]) + matched["max_jitter_samples"] <= 0.5)]
+    return report(f"chirp detection ({args.minutes} min @ {sr} Hz)", rows, checks)
+
+
+# ----------------------------
+# Cropping
+# ----------------------------
+
+def synthetic_video(path, seconds, gop_sec, fps=30, size="1280x720", cell=None):
+    """
+    H.264 + AAC test clip with a keyframe every gop_sec, like a phone recording.
+    cell=(x, y, w, h): noisy bench-coloured frames with a fixed blue cell
+    holder there, instead of the test pattern.
+    """
+    video = f"testsrc2=size={size}:rate={fps}:duration={seconds}"
+    if cell is not None:
+        x, y, w, h = cell
+        video = (f"color=c=0x827060:size={size}:rate={fps}:duration={seconds},noise=alls=8:allf=t,"
+                 f"drawbox=x={x}:y={y}:w={w}:h={h}:color=0x1E3CC8:t=fill")
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-nostdin", "-v", "error",
+            "-f", "lavfi", "-i", video,
+            "-f", "lavfi", "-i", f"sine=frequency=1000:sample_rate=48000:duration={seconds}",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-g", str(int(round(gop_sec * fps))), "-sc_threshold", "0",
+            "-c:a", "aac",
+            path
+        ],
+        check=True
+    )
+
+
+def video_info(path):
+    """(decoded video frames, container duration) of a file."""
+    out = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-count_frames",
+            "-show_entries", "stream=nb_read_frames:format=duration",
+            "-of", "json",
+            path
+        ],
+        capture_output=True, check=True, text=True
+    ).stdout
+    info = json.loads(out)
+    return int(info["streams"][0]["nb_read_frames"]), float(info["format"]["duration"])
+
+
+def bench_crop(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.mov")
+        synthetic_video(source, args.seconds, args.gop)
+
+        # Off-keyframe boundaries, like detected beacons
+        t_start, t_end = 0.09 * args.seconds + 0.017, 0.79 * args.seconds + 0.083
+        times, _ = smart_cut.probe_packets(source)
+        expected = int(np.count_nonzero((times >= t_start) & (times < t_end)))
+
+        croppers = {
+            "reencode": lambda out: protocol_cropping.crop_video(source, out, t_start, t_end),
+            "copy": lambda out: video_cropping.crop_video(source, out, t_start, t_end),
+            "smart": lambda out: smart_cut.smart_cut(source, out, t_start, t_end),
+        }
+
+        rows = []
+        for name, fn in croppers.items():
+            out = os.path.join(tmp, f"{name}.mov")
+            seconds, _ = time_call(lambda: fn(out), args.repeats)
+            frames, duration = video_info(out)
+            rows.append({"cropper": name, "seconds": round(seconds, 3), "frames": frames,
+                         "expected_frames": expected, "duration": round(duration, 3)})
+
+    reencode, _, smart = rows
+    smart["speedup"] = round(reencode["seconds"] / smart["seconds"], 1)
+    checks = [("smart cut keeps exactly the frames of the span", smart["frames"] == expected),
+              ("smart cut duration matches the re-encode", abs(smart["duration"] - reencode["duration"]) < 0.05)]
+    return report(f"cropping ({args.seconds:g} s, keyframe every {args.gop:g} s)", rows, checks)
+
+
+# ----------------------------
+# Audio/frame split
+# ----------------------------
+
+def same_tree(a, b):
+    names = sorted(os.listdir(a))
+    return names == sorted(os.listdir(b)) and all(
+        filecmp.cmp(os.path.join(a, n), os.path.join(b, n), shallow=False) for n in names)
+
+
+def bench_split(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.mov")
+        synthetic_video(source, args.seconds, gop_sec=1.0, size=args.size)
+
+        modes = {
+            "two_pass": lambda a, f: fast_split.fast_split(source, a, f, skip_if_exists=False, single_pass=False),
+            "single_pass": lambda a, f: fast_split.fast_split(source, a, f, skip_if_exists=False),
+            "sharded": lambda a, f: fast_split.fast_split_sharded(source, a, f, shards=args.shards,
+                                                                  skip_if_exists=False),
+        }
+
+        rows, dirs = [], {}
+        for name, fn in modes.items():
+            audio_dir, frame_dir = os.path.join(tmp, name, "audio"), os.path.join(tmp, name, "frames")
+            os.makedirs(audio_dir)
+            os.makedirs(frame_dir)
+            seconds, _ = time_call(lambda: fn(audio_dir, frame_dir), args.repeats)
+            dirs[name] = (audio_dir, frame_dir)
+            rows.append({"mode": name, "seconds": round(seconds, 3), "segments": len(os.listdir(audio_dir)),
+                         "frames": len(os.listdir(frame_dir))})
+
+        for row in rows[1:]:
+            row["speedup"] = round(rows[0]["seconds"] / row["seconds"], 2)
+        checks = [("single pass writes byte-identical audio segments", same_tree(dirs["two_pass"][0], dirs["single_pass"][0])),
+                  ("single pass writes byte-identical frames", same_tree(dirs["two_pass"][1], dirs["single_pass"][1])),
+                  ("sharded run writes the same segment names",
+                   sorted(os.listdir(dirs["sharded"][0])) == sorted(os.listdir(dirs["two_pass"][0]))),
+                  ("sharded run writes byte-identical frames", same_tree(dirs["two_pass"][1], dirs["sharded"][1]))]
+    return report(f"fast_split ({args.seconds:g} s @ {args.size})", rows, checks)
+
+
+# ----------------------------
+# Cell box detection
+# ----------------------------
+
+def synthetic_frame(rng, size=(3840, 2160)):
+    """
+    Bench-like BGR frame: noisy grey-brown background, one noisy blue cell
+    holder with a few 1-3 px bumps on its edges, a smaller blue blob and
+    isolated blue speckles (removed by the median filter).
+    """
+    width, height = size
+    img = np.clip(np.array([90, 110, 130]) + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    w, h = int(rng.integers(width // 10, width // 3)), int(rng.integers(height // 7, height // 3))
+    x, y = int(rng.integers(50, width - w - 50)), int(rng.integers(50, height - h - 50))
+    img[y:y + h, x:x + w] = np.clip(np.array([200, 60, 30]) + rng.normal(0, 10, (h, w, 3)), 0, 255)
+    img[y + h // 2, x - 1] = (200, 40, 30)
+    img[y + 20:y + 23, x + w:x + w + 3] = (200, 40, 30)
+    img[y - 2:y, x + w // 3:x + w // 3 + 4] = (200, 40, 30)
+    cx, cy = int(rng.integers(100, width - 100)), int(rng.integers(100, height - 100))
+    cv2.circle(img, (cx, cy), max(4, width // 128), (200, 60, 30), -1)
+    img[rng.integers(0, height, 200), rng.integers(0, width, 200)] = (200, 40, 30)
+    return cv2.GaussianBlur(img, (5, 5), 0) if rng.random() < 0.5 else img
+
+
+def bench_detect(args):
+    rng = np.random.default_rng(args.seed)
+    width, height = map(int, args.size.split("x"))
+    frames = [synthetic_frame(rng, (width, height)) for _ in range(args.frames)]
+
+    detectors = {
+        "full": lambda img: frame_cropping.find_cell_box(img, 10),
+        f"pyramid_1/{args.scale}": lambda img: frame_cropping.find_cell_box_pyramid(img, 10, scale=args.scale),
+    }
+    rows, boxes = [], {}
+    for name, fn in detectors.items():
+        seconds, boxes[name] = time_call(lambda: [fn(img) for img in frames], args.repeats)
+        rows.append({"detector": name, "ms_per_frame": round(1e3 * seconds / len(frames), 2)})
+    rows[1]["speedup"] = round(rows[0]["ms_per_frame"] / rows[1]["ms_per_frame"], 2)
+
+    full, pyramid = boxes.values()
+    checks = [("every frame has a box", all(b is not None for b in full)),
+              ("pyramid boxes are pixel-identical", full == pyramid)]
+    return report(f"cell box detection ({args.frames} frames @ {args.size})", rows, checks)
+
+
+def bench_framecrop(args):
+    width, height = map(int, args.size.split("x"))
+    cell = (width // 4 + 1, height // 5 + 3, width // 2 - 3, height // 2 + 1)   # odd offsets/sizes on purpose
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.mov")
+        synthetic_video(source, args.seconds, gop_sec=1.0, size=args.size, cell=cell)
+        dirs = {name: [os.path.join(tmp, name, sub) for sub in ("audio", "frames", "cropped")]
+                for name in ("jpeg_crop", "ffmpeg_crop")}
+        for paths in dirs.values():
+            for path in paths:
+                os.makedirs(path)
+
+        def jpeg_crop():
+            audio_dir, frame_dir, crop_dir = dirs["jpeg_crop"]
+            fast_split.fast_split(source, audio_dir, frame_dir, skip_if_exists=False)
+            frame_cropping.crop_all_images(frame_dir, crop_dir, chunk=10)
+
+        def ffmpeg_crop():
+            audio_dir, frame_dir, _ = dirs["ffmpeg_crop"]
+            fast_split.fast_split_cropped(source, audio_dir, frame_dir, chunk=10, skip_if_exists=False)
+
+        rows = []
+        for name, fn in (("jpeg_crop", jpeg_crop), ("ffmpeg_crop", ffmpeg_crop)):
+            seconds, _ = time_call(fn, args.repeats)
+            rows.append({"path": name, "seconds": round(seconds, 3)})
+        rows[1]["speedup"] = round(rows[0]["seconds"] / rows[1]["seconds"], 2)
+
+        old_dir, new_dir = dirs["jpeg_crop"][2], dirs["ffmpeg_crop"][1]
+        names = sorted(os.listdir(new_dir))
+        same_frames = len(names) > 0 and len(names) == len(os.listdir(dirs["jpeg_crop"][1]))
+        size_diff, psnr = 0, []
+        for name in names:
+            new, old = cv2.imread(os.path.join(new_dir, name)), cv2.imread(os.path.join(old_dir, "cropped_" + name))
+            size_diff = max(size_diff, *np.abs(np.subtract(old.shape[:2], new.shape[:2])))
+            # Centre-aligned overlap (a 1 px wider box grows on both sides)
+            h, w = min(old.shape[0], new.shape[0]), min(old.shape[1], new.shape[1])
+            oy, ox = (old.shape[0] - h) // 2, (old.shape[1] - w) // 2
+            ny, nx = (new.shape[0] - h) // 2, (new.shape[1] - w) // 2
+            psnr.append(cv2.PSNR(old[oy:oy + h, ox:ox + w], new[ny:ny + h, nx:nx + w]))
+        rows[1].update(frames=len(names), max_size_diff=int(size_diff), min_psnr_db=round(min(psnr), 1))
+
+    # The old path detects on JPEG-decoded frames, whose ringing can widen the
+    # blue edge by a pixel: crops may differ by up to 1 px per side
+    checks = [("same frames", same_frames),
+              ("crop sizes within 1 px per side", size_diff <= 2),
+              ("crop content matches (PSNR > 30 dB)", min(psnr) > 30)]
+    return report(f"frame cropping ({args.seconds:g} s @ {args.size})", rows, checks)
+
+
+# ----------------------------
+# Stores
+# ----------------------------
+
+def bench_store(args):
+    rng = np.random.default_rng(args.seed)
+    width, height = map(int, args.size.split("x"))
+    sr, seg = 48000, 96000
+
+    def clip(n):
+        return (rng.integers(0, 256, (n, height, width, 3), dtype=np.uint8),
+                rng.integers(-32768, 32768, n * seg - seg // 3, dtype=np.int16))
+
+    names = ("a", "b", "c")
+    expected = {name: clip(args.frames + k) for k, name in enumerate(names)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        frames_path, pcm_path = os.path.join(tmp, "frames"), os.path.join(tmp, "segments")
+
+        def write(names, append):
+            with frame_store.FrameStoreWriter(frames_path, size=(width, height), append=append) as frames, \
+                    segment_store.SegmentStoreWriter(pcm_path, sr, seg / sr, append=append) as pcm:
+                for name in names:
+                    frames.add_frames(name, expected[name][0])
+                    pcm.add_pcm(name, expected[name][1], label=0)
+
+        write(names, append=False)
+        # Replace the first and a middle recording (new lengths): their old
+        # frames / samples stay in the stack ahead of the new ones
+        for k, name in enumerate(("a", "b")):
+            expected[name] = clip(args.frames // 2 + 3 * k)
+        write(("a", "b"), append=True)
+
+        frames, pcm = frame_store.FrameStore(frames_path), segment_store.SegmentStore(pcm_path)
+        same_frames = same_items = same_pcm = same_segments = True
+        for name in names:
+            video, audio = expected[name]
+            rows = np.flatnonzero(frames.index["video"] == frames.videos.index(name))
+            same_frames &= np.array_equal(frames.frames_of(name), video)
+            same_items &= np.array_equal(np.stack([frames[i] for i in rows]), video)
+            same_pcm &= np.array_equal(pcm.recording(name), audio)
+            same_segments &= np.array_equal(np.concatenate([pcm[i] for i in pcm.segments_of(name)]), audio)
+        rows = [{"store": "frame_store", "rows": len(frames), "stack_frames": frames.manifest["num_frames"]},
+                {"store": "segment_store", "rows": len(pcm), "stack_samples": pcm.manifest["num_samples"]}]
+        del frames, pcm
+
+    checks = [("frame_store: frames_of() matches after replace", bool(same_frames)),
+              ("frame_store: store[i] matches after replace", bool(same_items)),
+              ("segment_store: recording() matches after replace", bool(same_pcm)),
+              ("segment_store: store[i] matches after replace", bool(same_segments))]
+    return report(f"store replace ({len(names)} recordings, {args.frames} frames @ {args.size})", rows, checks)
+
+
+# ----------------------------
+# Spectrograms
+# ----------------------------
+
+STFT_KWARGS = dict(n_fft=2048, hop_length=240, win_length=480, fmin=15000, fmax=19200)
+
+
+def recording_segments(minutes, seed, segment_sec=2.0):
+    """Equal-length int16 segments of a synthetic recording (fast_split grid)."""
+    pcm, sr, _ = synthetic_recording(minutes, seed=seed)
+    step = int(round(segment_sec * sr))
+    n = pcm.size // step
+    return pcm[:n * step].reshape(n, step), sr
+
+
+def bench_stft(args):
+    segments, sr = recording_segments(args.minutes, args.seed)
+
+    def librosa_path():
+        return np.stack([stft_fft_librosa.compute_frequency_domain_spectrogram(seg, sr, **STFT_KWARGS)[0]
+                         for seg in segments])
+
+    def batch_path(backend):
+        return lambda: stft_batch.compute_spectrogram_batch(segments, sr, batch=args.batch, backend=backend,
+                                                            **STFT_KWARGS)[0]
+
+    rows, outputs = [], {}
+    for name, fn in (("librosa", librosa_path), ("batch", batch_path("rfft")), ("zoom", batch_path("zoom"))):
+        seconds, outputs[name] = time_call(fn, args.repeats)
+        rows.append({"engine": name, "seconds": round(seconds, 3), "ms_per_segment": round(1e3 * seconds / len(segments), 3)})
+
+    ref = outputs["librosa"]
+    for row in rows[1:]:
+        out = outputs[row["engine"]]
+        row["speedup"] = round(rows[0]["seconds"] / row["seconds"], 1)
+        row["max_abs_db_diff"] = float(np.abs(ref - out).max()) if ref.shape == out.shape else float("inf")
+        row["values_off_by_0.01db"] = float(np.mean(np.abs(ref - out) > 0.01)) if ref.shape == out.shape else 1.0
+
+    # zoom has no full spectrum: its top_db floor comes from the band peak, so only
+    # bins clamped by one of the two floors may differ
+    batch, zoom = rows[1], rows[2]
+    checks = [("same (N, F_band, T) shape", ref.shape == outputs["batch"].shape == outputs["zoom"].shape),
+              ("batch: same dB values (< 0.01 dB)", batch["max_abs_db_diff"] < 0.01),
+              ("zoom: same dB values outside the top_db floor (< 0.1% of values differ)",
+               zoom["values_off_by_0.01db"] < 1e-3)]
+    return report(f"band spectrograms ({len(segments)} segments of 2 s)", rows, checks)
+
+
+def bench_recording(args):
+    pcm, sr, _ = synthetic_recording(args.minutes, seed=args.seed)
+    step = int(round(2.0 * sr))
+    starts = range(0, pcm.size, step)
+
+    def per_segment():
+        # batched engine over the 2 s segments (the last one shorter), as the pipeline does
+        return dict(stft_batch.spectrograms(starts, lambda s: pcm[s:s + step], sr, **STFT_KWARGS))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "recording")
+
+        def whole():
+            recording_spectrogram.write_recording_spectrogram(pcm, path, sr, **STFT_KWARGS)
+            store = recording_spectrogram.RecordingSpectrogram(path)
+            return [store.segment(k, top_db=True) for k in range(len(store))]
+
+        rows, outputs = [], {}
+        for name, fn in (("per_segment", per_segment), ("whole_recording", whole)):
+            seconds, outputs[name] = time_call(fn, args.repeats)
+            rows.append({"mode": name, "seconds": round(seconds, 3)})
+        rows[1]["speedup"] = round(rows[0]["seconds"] / rows[1]["seconds"], 2)
+
+        store = recording_spectrogram.RecordingSpectrogram(path)
+        zero_copy = all(np.shares_memory(store.segment(k), store.spec) for k in range(len(store)))
+
+    ref = [outputs["per_segment"][s] for s in starts]
+    got = outputs["whole_recording"]
+    same_shapes = len(ref) == len(got) and all(a.shape == b.shape for a, b in zip(ref, got))
+    # Edge columns see the neighbouring audio instead of zero padding
+    interior = max(float(np.abs(a[:, 1:-1] - b[:, 1:-1]).max()) for a, b in zip(ref, got)) if same_shapes else float("inf")
+    rows[1].update(segments=len(got), max_interior_db_diff=interior)
+    checks = [("same segments and (F_band, T) shapes", same_shapes),
+              ("same dB values away from segment edges (< 0.01 dB)", interior < 0.01),
+              ("segments are zero-copy slices of the recording", zero_copy)]
+    return report(f"whole-recording STFT ({args.minutes:g} min)", rows, checks)
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = p.add_subparsers(dest="command", required=True)
+
+    beacon = sub.add_parser("beacon", help="detect_beacons vs. narrowband detector")
+    beacon.add_argument("--minutes", type=float, default=3.0, help="protocol length")
+    beacon.add_argument("--repeats", type=int, default=3)
+    beacon.add_argument("--seed", type=int, default=0)
+    beacon.set_defaults(func=bench_beacon)
+
+    chirps = sub.add_parser("chirps", help="spectral flux vs. coarse-to-fine vs. matched filter")
+    chirps.add_argument("--minutes", type=float, default=3.0, help="protocol length")
+    chirps.add_argument("--repeats", type=int, default=1)
+    chirps.add_argument("--seed", type=int, default=0)
+    chirps.set_defaults(func=bench_chirps)
+
+    crop = sub.add_parser("crop", help="full re-encode vs. stream copy vs. smart cut")
+    crop.add_argument("--seconds", type=float, default=60.0, help="test clip length")
+    crop.add_argument("--gop", type=float, default=2.0, help="keyframe interval (seconds)")
+    crop.add_argument("--repeats", type=int, default=1)
+    crop.set_defaults(func=bench_crop)
+
+    split = sub.add_parser("split", help="fast_split: two ffmpeg runs vs. one vs. time-range shards")
+    split.add_argument("--seconds", type=float, default=120.0, help="test clip length")
+    split.add_argument("--size", default="1920x1080", help="test clip resolution (e.g. 3840x2160)")
+    split.add_argument("--shards", type=int, default=None, help="time ranges (default: all cores)")
+    split.add_argument("--repeats", type=int, default=1)
+    split.set_defaults(func=bench_split)
+
+    detect = sub.add_parser("detect", help="find_cell_box vs. downscaled detection with full-res edges")
+    detect.add_argument("--frames", type=int, default=20)
+    detect.add_argument("--size", default="3840x2160", help="frame resolution")
+    detect.add_argument("--scale", type=int, default=4, help="downscale factor (4 or 8)")
+    detect.add_argument("--repeats", type=int, default=3)
+    detect.add_argument("--seed", type=int, default=0)
+    detect.set_defaults(func=bench_detect)
+
+    framecrop = sub.add_parser("framecrop", help="fast_split + crop_all_images vs. ffmpeg crop= during extraction")
+    framecrop.add_argument("--seconds", type=float, default=60.0, help="test clip length")
+    framecrop.add_argument("--size", default="1920x1080", help="test clip resolution")
+    framecrop.add_argument("--repeats", type=int, default=1)
+    framecrop.set_defaults(func=bench_framecrop)
+
+    store = sub.add_parser("store", help="frame / segment store: replace recordings, then read them back")
+    store.add_argument("--frames", type=int, default=40, help="frames per recording")
+    store.add_argument("--size", default="320x180", help="stored frame size")
+    store.add_argument("--seed", type=int, default=0)
+    store.set_defaults(func=bench_store)
+
+    stft = sub.add_parser("stft", help="per-segment librosa STFT vs. batched rfft / band-only zoom engine")
+    stft.add_argument("--minutes", type=float, default=2.0, help="synthetic recording length")
+    stft.add_argument("--batch", type=int, default=64, help="segments per FFT call")
+    stft.add_argument("--repeats", type=int, default=1)
+    stft.add_argument("--seed", type=int, default=0)
+    stft.set_defaults(func=bench_stft)
+
+    recording = sub.add_parser("recording", help="per-segment STFTs vs. one streamed STFT per recording")
+    recording.add_argument("--minutes", type=float, default=5.0, help="synthetic recording length")
+    recording.add_argument("--repeats", type=int, default=1)
+    recording.add_argument("--seed", type=int, default=0)
+    recording.set_defaults(func=bench_recording)
+
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    return 0 if args.func(args) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
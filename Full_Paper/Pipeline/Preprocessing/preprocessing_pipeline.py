@@ -1,6 +1,14 @@
-from fast_split import fast_split
+from fast_split import split_many
 from frame_cropping import crop_all_images
-from stft_fft_librosa import compute_frequency_domain_spectrogram
+from stft_fft_librosa import compute_frequency_domain_spectrogram, load_audio
+from stft_batch import spectrograms
+from recording_spectrogram import RecordingSpectrogram, recording_name, write_recording_spectrogram
+from recording_spectrogram import store_paths as recording_store_paths
+from crop_records import as_record, is_record_path
+from stage_manifest import StageManifest
+import segment_store
+from segment_store import SegmentStore
+import frame_store
 from tqdm import tqdm
 import numpy as np
 import glob, os
@@ -9,6 +17,7 @@ if __name__ == "__main__":
 
     #======= CONFIGURATIONS =======
     #=== PATHS ===
+    # Cropped videos and/or crop records (crpd_*.crop.json from protocol_cropping --crop-mode virtual)
     RAW_VIDEOS_DIR = "/Users/pedropaiva/Documents/Dev/Research/CoBasE-Energy/cobas/Acoustic_Dataset_Collection/BeaconDataset/official00/test/crpd_raw_videos"
 
     AUDIO_SEGMENTS_DIR = "/Users/pedropaiva/Documents/Dev/Research/CoBasE-Energy/cobas/Acoustic_Dataset_Collection/BeaconDataset/official00/test/audio_segments"
@@ -25,45 +34,230 @@ if __name__ == "__main__":
     FMIN = 15000
     FMAX = 19200
 
+    #=== PARALLEL SPLIT ===
+    SPLIT_WORKERS = None        # concurrent ffmpeg processes, None -> cores // 2
+    SPLIT_THREADS = None        # ffmpeg -threads each, None -> cores // workers
+    # True: VIDEO_FRAMES_DIR receives cell crops, cropped by ffmpeg when the box is
+    # stable over the recording (replaces the crop_all_images step below)
+    SPLIT_CROP_FRAMES = False
+
+    # True: spectrograms of crop records are computed from the original recording
+    # (2 s spans on the fast_split grid) instead of from the written audio segments
+    STFT_FROM_RECORDS = False
+
+    # Segments per batched STFT (stft_batch: one multi-threaded rfft per batch,
+    # same dB values as the librosa path), None -> one librosa call per segment
+    STFT_BATCH = 64
+    # Batched engine backend: "rfft" (full spectrum, then the band) or "zoom" (band
+    # bins only; top_db floor relative to the band peak instead of the full spectrum)
+    STFT_BACKEND = "rfft"
+
+    # True: one streamed STFT per recording (video or crop record) stored in
+    # RECORDING_SPEC_DIR; segments are column slices on the fast_split 2 s grid
+    # (the split writes frames only, no segment WAVs), exported as per-segment
+    # <name>_segNNN.npy files to RECORDING_SEGMENT_ARRAYS_DIR when STFT_EXPORT_SEGMENTS
+    # (edge columns see the neighbouring audio, so they are kept apart from the
+    # per-segment STFT output). Replaces the per-segment STFT below
+    STFT_WHOLE_RECORDING = False
+    STFT_EXPORT_SEGMENTS = True
+
+    # Path prefix of a single memmapped segment store (<prefix>.pcm/.index.npy/.json),
+    # None -> the STFT stage reads the per-segment .wav files; otherwise the split
+    # writes no audio segments, new/changed recordings are appended to the store
+    # (<prefix>.stage.json) and the STFT stage slices segments out of the memmap
+    SEGMENT_STORE = None
+
+    # Path prefix of a uint8 frame stack (<prefix>.frames/.index.npy/.json) written
+    # straight from decoded video, cropped to the cell and resized in memory
+    # (training reads it instead of the JPEG frames + crop_all_images: the split
+    # writes no frames, new/changed recordings are appended, <prefix>.stage.json),
+    # None -> disabled
+    FRAME_STORE = None
+    FRAME_STORE_SIZE = (224, 224)    # (width, height) of stored frames
+    FRAME_STORE_CROP = True
+    FRAME_STORE_CHUNK = 10           # crop margin, as crop_all_images(chunk=...) (also SPLIT_CROP_FRAMES)
+    CROP_DETECT_SCALE = 4            # cell detection on a 1/4 image, exact full-res edges (None -> full res)
+
+    #=== INCREMENTAL RERUNS ===
+    # Per-stage manifests (input hash, params, outputs): only new/changed/incomplete inputs are redone.
+    # The split stage has no way to tell a complete old split from an interrupted one: its
+    # first run with a manifest re-splits every video once
+    SPLIT_MANIFEST = os.path.join(AUDIO_SEGMENTS_DIR, "fast_split_manifest.json")
+    STFT_MANIFEST = os.path.join(FFT_SPEC_ARRAYS_DIR, "stft_manifest.json")
+    RECORDING_SPEC_DIR = os.path.join(FFT_SPEC_ARRAYS_DIR, "recordings")
+    RECORDING_STFT_MANIFEST = os.path.join(RECORDING_SPEC_DIR, "recording_stft_manifest.json")
+    RECORDING_SEGMENT_ARRAYS_DIR = os.path.join(RECORDING_SPEC_DIR, "segments")
+    # First run with a manifest: existing spectrogram .npy files (readable header, full
+    # size) are recorded as done instead of recomputed. They are trusted to match the
+    # current STFT settings; delete them or set False after changing those
+    ADOPT_EXISTING_OUTPUTS = True
+
     #======= PREPROCESSING =======
 
     if not os.path.isdir(RAW_VIDEOS_DIR):
         print("[ERROR]: NO RAW VIDEOS DIR FOUND!")
 
-    os.makedirs(AUDIO_SEGMENTS_DIR, exist_ok=True)
-    os.makedirs(VIDEO_FRAMES_DIR, exist_ok=True)
+    # Outputs of the split; None -> not written (kept in the segment / frame store,
+    # or not needed by the whole-recording STFT)
+    split_audio_dir = None if SEGMENT_STORE or STFT_WHOLE_RECORDING else AUDIO_SEGMENTS_DIR
+    split_frame_dir = None if FRAME_STORE else VIDEO_FRAMES_DIR
+
+    if split_audio_dir:
+        os.makedirs(AUDIO_SEGMENTS_DIR, exist_ok=True)
+    if split_frame_dir:
+        os.makedirs(VIDEO_FRAMES_DIR, exist_ok=True)
     os.makedirs(CROPPED_FRAMES_DIR, exist_ok=True)
     os.makedirs(FFT_SPEC_ARRAYS_DIR, exist_ok=True)
 
     raw_video_files = glob.glob(RAW_VIDEOS_DIR + "/*")
 
     #=== AUDIO/FRAME CHUNK SPLIT ===
-    print("[UPDATE]: AUDIO/FRAME EXTRACTION INITIALIZED!")
-    for video_file in tqdm(raw_video_files):
-        fast_split(video_path=video_file,
-                   out_audio_dir=AUDIO_SEGMENTS_DIR,
-                   out_frame_dir=VIDEO_FRAMES_DIR)
+    if split_audio_dir or split_frame_dir:
+        print("[UPDATE]: AUDIO/FRAME EXTRACTION INITIALIZED!")
+        split_records = split_many(raw_video_files,
+                                   out_audio_dir=split_audio_dir,
+                                   out_frame_dir=split_frame_dir,
+                                   workers=SPLIT_WORKERS,
+                                   threads_per_worker=SPLIT_THREADS,
+                                   crop_frames=SPLIT_CROP_FRAMES,
+                                   chunk=FRAME_STORE_CHUNK,
+                                   manifest_path=SPLIT_MANIFEST)
+        for r in split_records:
+            if r["status"] == "error":
+                print(f"[ERROR]: SPLIT FAILED FOR {r['video']}: {r['error']}")
+
+    if SEGMENT_STORE:
+        print("[UPDATE]: SEGMENT STORE INITIALIZED!")
+        added = segment_store.update_store(SEGMENT_STORE, sorted(raw_video_files), sample_rate=SAMPLING_RATE,
+                                           progress=tqdm)
+        print(f"[UPDATE]: {len(added)} RECORDINGS (RE)ADDED TO THE SEGMENT STORE")
+
+    if FRAME_STORE:
+        print("[UPDATE]: FRAME STORE INITIALIZED!")
+        added = frame_store.update_store(FRAME_STORE, sorted(raw_video_files), size=FRAME_STORE_SIZE,
+                                         crop=FRAME_STORE_CROP, chunk=FRAME_STORE_CHUNK,
+                                         scale=CROP_DETECT_SCALE, progress=tqdm)
+        print(f"[UPDATE]: {len(added)} RECORDINGS (RE)ADDED TO THE FRAME STORE")
 
     #=== VIDEO FRAME CROPPING ===
     # print("[UPDATE]: FRAME CROPPING INITIALIZED!")
     # crop_all_images(extracted_frames_dir=VIDEO_FRAMES_DIR,
     #                 output_dir=CROPPED_FRAMES_DIR,
     #                 verbose=False,
-    #                 chunk=10)
+    #                 chunk=FRAME_STORE_CHUNK,
+    #                 scale=CROP_DETECT_SCALE)
 
     #=== FREQUENCY-DOMAIN SPEC. ARRAY COMPUTATION ===
-    audio_segment_files = glob.glob(AUDIO_SEGMENTS_DIR + "/*")
-    print("[UPDATE]: STFT/FFT COMPUTE INITIALIZED!")
-    for segment_file_path in tqdm(audio_segment_files):
-        S_ultra = compute_frequency_domain_spectrogram(
-            audio_path=segment_file_path,
-            sampling_rate=SAMPLING_RATE,
-            n_fft=N_FFT,
-            hop_length=HOP_LENGTH,
-            win_length=WIN_LENGTH,
-            fmin=FMIN,
-            fmax=FMAX)
+    audio_segment_files = glob.glob(AUDIO_SEGMENTS_DIR + "/*.wav") if split_audio_dir else []
+    if STFT_FROM_RECORDS:
+        records = [as_record(f) for f in raw_video_files if is_record_path(f)]
+        names = {r.name for r in records}
+        audio_segment_files = [f for f in audio_segment_files
+                               if os.path.basename(f).rsplit("_seg", 1)[0] not in names]
+        audio_segment_files += [seg for r in records for seg in r.segments(2.0)]
+
+    stft_manifest = StageManifest(STFT_MANIFEST, "stft",
+                                  {"sampling_rate": SAMPLING_RATE, "n_fft": N_FFT, "hop_length": HOP_LENGTH,
+                                   "win_length": WIN_LENGTH, "fmin": FMIN, "fmax": FMAX,
+                                   "backend": STFT_BACKEND if STFT_BATCH else "librosa"})
+
+    stft_kwargs = dict(n_fft=N_FFT, hop_length=HOP_LENGTH, win_length=WIN_LENGTH, fmin=FMIN, fmax=FMAX)
 
+    def stft_results(items, load):
+        # (item, S_ultra) pairs, batched or one librosa call per item
+        if STFT_BATCH:
+            return spectrograms(items, load, SAMPLING_RATE, batch=STFT_BATCH, backend=STFT_BACKEND, **stft_kwargs)
+        return ((item, compute_frequency_domain_spectrogram(load(item), SAMPLING_RATE, **stft_kwargs)[0])
+                for item in items)
+
+    if STFT_WHOLE_RECORDING:
+        print("[UPDATE]: STFT/FFT COMPUTE (WHOLE RECORDINGS) INITIALIZED!")
+        os.makedirs(RECORDING_SPEC_DIR, exist_ok=True)
+        if STFT_EXPORT_SEGMENTS:
+            os.makedirs(RECORDING_SEGMENT_ARRAYS_DIR, exist_ok=True)
+        recording_manifest = StageManifest(RECORDING_STFT_MANIFEST, "recording_stft",
+                                           {**stft_kwargs, "sampling_rate": SAMPLING_RATE, "segment_sec": 2.0,
+                                            "backend": STFT_BACKEND, "export": STFT_EXPORT_SEGMENTS,
+                                            "export_dir": os.path.abspath(RECORDING_SEGMENT_ARRAYS_DIR)})
+        for recording in tqdm(sorted(raw_video_files)):
+            record = as_record(recording)
+            name = recording_name(recording)
+            hashed = record.source if record is not None else recording
+            key = f"{os.path.abspath(hashed)}#{name}" if record is not None else None
+            extra = {"span": [record.start_sample, record.end_sample]} if record is not None else None
+            if not recording_manifest.needs_run(hashed, extra, key)[0]:
+                continue
+            recording_manifest.invalidate(hashed, key)   # stale exports of an older / longer run
+
+            store_path = os.path.join(RECORDING_SPEC_DIR, name)
+            write_recording_spectrogram(recording, store_path, SAMPLING_RATE, segment_sec=2.0,
+                                        backend=STFT_BACKEND, **stft_kwargs)
+            outputs = list(recording_store_paths(store_path))
+            if STFT_EXPORT_SEGMENTS:
+                outputs += RecordingSpectrogram(store_path).export_segments(RECORDING_SEGMENT_ARRAYS_DIR)
+            recording_manifest.record(hashed, outputs, extra, key)
+            recording_manifest.checkpoint()
+        recording_manifest.save()
+        audio_segment_files = []
+
+    def stft_target(segment_file_path):
+        # (hashed input, manifest key, per-input params, output .npy)
+        record = as_record(segment_file_path)
+        if record is not None:
+            # Segment of a crop record: hash the source, key by segment
+            return (record.source, f"{os.path.abspath(record.source)}#{record.name}",
+                    {"span": [record.start_sample, record.end_sample]},
+                    FFT_SPEC_ARRAYS_DIR + '/' + record.name + ".npy")
         file_name = segment_file_path.split('/')[-1].split('.')[0] + ".npy"
-        file_name = FFT_SPEC_ARRAYS_DIR + '/' + file_name
-        np.save(file_name, S_ultra.astype(np.float32))
+        return segment_file_path, None, None, FFT_SPEC_ARRAYS_DIR + '/' + file_name
+
+    def complete_npy(path):
+        # np.load(mmap_mode="r") parses the header and fails on a truncated array
+        try:
+            np.load(path, mmap_mode="r")
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def compute_stft(items, target, load):
+        # Spectrograms of the items the STFT manifest does not list as done
+        pending = []
+        adopted = 0
+        for item in items:
+            hashed, key, extra, file_name = target(item)
+            needed, reason = stft_manifest.needs_run(hashed, extra, key)
+            if needed and reason == "new" and ADOPT_EXISTING_OUTPUTS and os.path.exists(file_name) \
+                    and complete_npy(file_name) and stft_manifest.adopt(hashed, [file_name], extra, key):
+                adopted += 1
+                continue
+            if needed:
+                pending.append(item)
+        if adopted:
+            print(f"[UPDATE]: {adopted} EXISTING SPECTROGRAMS ADOPTED INTO THE STFT MANIFEST")
+            stft_manifest.save()
+
+        for item, S_ultra in tqdm(stft_results(pending, load), total=len(pending)):
+            hashed, key, extra, file_name = target(item)
+            np.save(file_name, S_ultra.astype(np.float32))
+
+            stft_manifest.record(hashed, [file_name], extra, key)
+            stft_manifest.checkpoint()
+
+        stft_manifest.save()
+
+    if SEGMENT_STORE and not STFT_WHOLE_RECORDING:
+        store = SegmentStore(SEGMENT_STORE)
+
+        def store_target(i):
+            # Segment of a stored recording: hash the recording it was decoded from, key by segment
+            source, name = store.source(i), store.name(i)
+            extra = {"segment_store": True, "span": source["span"], "length": int(store.index[i]["length"])}
+            return (source["path"], f"{source['path']}#{name}", extra,
+                    FFT_SPEC_ARRAYS_DIR + '/' + name + ".npy")
+
+        print("[UPDATE]: STFT/FFT COMPUTE (SEGMENT STORE) INITIALIZED!")
+        compute_stft(range(len(store)), store_target, store.__getitem__)
+
+    if audio_segment_files:
+        print("[UPDATE]: STFT/FFT COMPUTE INITIALIZED!")
+        compute_stft(audio_segment_files, stft_target, lambda path: load_audio(path, SAMPLING_RATE))
@@ -1,18 +1,29 @@
 import subprocess
 import numpy as np
 import sys
+import os
 np.set_printoptions(threshold=sys.maxsize)
-import wave
-from scipy.signal import butter, filtfilt, hilbert
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import deque
+from scipy.signal import butter, filtfilt, hilbert, sosfilt, group_delay
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import protocol_timeline
+from media_reader import read_audio, iter_audio_blocks, to_float32
+from smart_cut import crop_video, smart_cut
+from crop_records import CropRecord, record_path, save_record
+
 # ==========================================================
 # USER CONFIGURATION
 # ==========================================================
 
 VIDEO_PATH = "/Users/pedropaiva/Documents/Dev/Research/CoBasE-Energy/cobas/Acoustic_Dataset_Collection/BeaconDataset/official00/test/raw_videos/100p_test.MOV"
 OUTPUT_VIDEO = "/Users/pedropaiva/Documents/Dev/Research/CoBasE-Energy/cobas/Acoustic_Dataset_Collection/BeaconDataset/official00/test/crpd_raw_videos/crpd_100p_test.MOV"
-TEMP_AUDIO = "temp_audio.wav"
 
 SAMPLE_RATE = 48000
 
@@ -21,34 +32,25 @@ BEACON_BW = 300            # ± Hz around beacon frequency
 MIN_BEACON_DURATION = 2.5  # seconds
 THRESHOLD_RATIO = 0.3      # relative energy threshold
 
-# ==========================================================
-# AUDIO EXTRACTION (VIDEO → WAV)
-# ==========================================================
-
-def extract_audio(video_path, audio_path):
-    subprocess.run(
-        [
-            "ffmpeg",
-            "-y",                 # overwrite output if it exists
-            "-i", video_path,     # input video
-            "-vn",                # remove video stream
-            "-ac", "1",           # force mono
-            "-ar", str(SAMPLE_RATE),  # resample for predictability
-            audio_path
-        ],
-        check=True
-    )
-
-# ==========================================================
-# LOAD WAV AUDIO (BIT-EXACT)
-# ==========================================================
-
-def load_wav(path):
-    with wave.open(path, "rb") as wf:
-        sr = wf.getframerate()
-        frames = wf.readframes(wf.getnframes())
-        audio = np.frombuffer(frames, dtype=np.int16)
-    return audio.astype(np.float32), sr
+# Timeline manifest of the played protocol (<protocol>.timeline.json), None -> full-recording search
+TIMELINE_PATH = None
+MAX_PLAYBACK_LEAD_SEC = 60.0  # latest the protocol may start after the recording does
+SEARCH_MARGIN_SEC = 1.0       # ± slack around timeline positions (clock drift, latency)
+
+# Beacon detector used by main(): "full" (filtfilt + Hilbert), "streaming" (block-wise)
+# "narrowband" (heterodyne + decimation at BEACON_FREQ) or "coarse_fine" (decimated
+# search, full-rate refinement around the two edges)
+BEACON_DETECTOR = "full"
+STREAM_BLOCK_SAMPLES = 1 << 16  # decoded samples per block (streaming detector)
+STREAM_HOP = 48                 # envelope resolution in samples (1 ms @ 48 kHz)
+NARROWBAND_HOP = 160            # samples per narrowband envelope value (300 Hz @ 48 kHz)
+COARSE_HOP = 960                # coarse-stage envelope resolution (50 Hz @ 48 kHz)
+REFINE_PAD_SEC = 0.05           # extra full-rate context around each refined edge (filter settling)
+
+# Cropper: "reencode" (whole span through libx264), "smart" (stream copy between
+# the first/last keyframes of the span, only the boundary GOPs re-encoded) or
+# "virtual" (no video written: crpd_<name>.crop.json for fast_split / STFT to seek into)
+CROP_MODE = "reencode"
 
 # ==========================================================
 # DSP UTILITIES
@@ -65,11 +67,27 @@ def envelope(signal):
     analytic = hilbert(signal)
     return np.abs(analytic)
 
-def plotting_env_threshold(env, threshold, sr, start, end):
-    time = np.arange(len(env)) / sr
+PLOT_POINTS = 100000   # most envelope points drawn per piece (block maxima beyond that)
+
+def plotting_env_threshold(env, threshold, sr, start, end, save_path=None):
+    plot_beacon_diagnostics({"threshold": threshold, "envelopes": [(0.0, sr, env)]}, start, end, save_path)
+
+def plot_beacon_diagnostics(diagnostics, start, end, save_path=None):
+    """
+    :param diagnostics: {"threshold", "envelopes": [(t0 seconds, rate Hz, env), ...]}
+                        as returned by the detectors with return_diagnostics=True
+    """
+    threshold = diagnostics["threshold"]
 
     plt.figure(figsize=(12, 4))
-    plt.plot(time, env, label="Envelope (10 kHz band)")
+    for i, (t0, rate, env) in enumerate(diagnostics["envelopes"]):
+        step = max(1, -(-len(env) // PLOT_POINTS))
+        if step > 1:
+            # Block maxima: long full-rate envelopes stay drawable, peaks are kept
+            n = -(-len(env) // step)
+            env = np.pad(env, (0, n * step - len(env)), mode="edge").reshape(n, step).max(axis=1)
+        time = t0 + np.arange(len(env)) * step / rate
+        plt.plot(time, env, color="C0", label="Envelope (10 kHz band)" if i == 0 else None)
     plt.axhline(threshold, color="red", linestyle="--", label="Threshold")
 
     plt.axvline(start, color="yellow", linestyle="--", label="start")
@@ -80,13 +98,21 @@ def plotting_env_threshold(env, threshold, sr, start, end):
     plt.title("Beacon Envelope and Detection Threshold")
     plt.legend()
     plt.tight_layout()
-    plt.show()
+    if save_path:
+        # Headless: write the figure instead of blocking on a window
+        plt.savefig(save_path, dpi=100)
+        plt.close()
+    else:
+        plt.show()
 
 # ==========================================================
 # BEACON DETECTION (CORE LOGIC)
 # ==========================================================
 
-def detect_beacons(audio, sr):
+def detect_beacons(audio, sr, plot=True, return_diagnostics=False):
+    # return_diagnostics: also return the envelope and threshold the detection used
+    # ({"threshold", "envelopes": [(t0, rate, env)]}, see plot_beacon_diagnostics)
+
     # Isolate beacon frequency band
     filtered = bandpass(audio, sr, BEACON_FREQ, BEACON_BW)
 
@@ -116,51 +142,423 @@ def detect_beacons(audio, sr):
     # print(t_BEGIN_beacon_end == t_END_beacon_start)
     print(t_start, t_end)
 
-    plotting_env_threshold(env, threshold, sr, t_start, t_end)
+    if plot:
+        plotting_env_threshold(env, threshold, sr, t_start, t_end)
+
+    if return_diagnostics:
+        return t_start, t_end, {"threshold": float(threshold), "envelopes": [(0.0, sr, env)]}
+    return t_start, t_end
+
+# ==========================================================
+# TIMELINE-GUIDED BEACON DETECTION
+# ==========================================================
+
+def detect_beacons_windowed(audio, sr, timeline_path,
+                            max_lead_sec=MAX_PLAYBACK_LEAD_SEC,
+                            margin_sec=SEARCH_MARGIN_SEC, return_diagnostics=False):
+    # Same output as detect_beacons(), but only filters two small windows:
+    # the BEGIN beacon within the first max_lead_sec of playback, then the END
+    # beacon ± margin_sec around where the timeline manifest places it
+    manifest, events = protocol_timeline.load_timeline(timeline_path)
+    if manifest["sample_rate"] != sr:
+        raise ValueError(f"Timeline is {manifest['sample_rate']} Hz, audio is {sr} Hz")
+
+    beacons = protocol_timeline.events_of(events, "beacon")
+    begin, end = beacons[0], beacons[-1]
+    margin = int(round(margin_sec * sr))
+
+    # BEGIN beacon window (protocol start offset is unknown here)
+    begin_stop = min(len(audio), int(round(max_lead_sec * sr)) + int(begin["start"] + begin["length"]) + margin)
+    env_begin = envelope(bandpass(audio[:begin_stop], sr, BEACON_FREQ, BEACON_BW))
+
+    indices = np.where(env_begin > THRESHOLD_RATIO * np.max(env_begin))[0]
+    if len(indices) == 0:
+        raise RuntimeError("No beacon energy detected")
+
+    # Recording sample of protocol sample 0
+    offset = int(indices[0]) - int(begin["start"])
+
+    # END beacon window from the timeline
+    windows = protocol_timeline.search_windows(end[None], offset, margin, n_total=len(audio))
+    if not windows:
+        raise RuntimeError("END beacon window falls outside the recording")
+    w_start, w_end = windows[0]
+    env_end = envelope(bandpass(audio[w_start:w_end], sr, BEACON_FREQ, BEACON_BW))
+
+    # Threshold relative to both beacons, as in detect_beacons()
+    threshold = THRESHOLD_RATIO * max(np.max(env_begin), np.max(env_end))
+    first = np.where(env_begin > threshold)[0]
+    last = np.where(env_end > threshold)[0]
+    if len(first) == 0 or len(last) == 0:
+        raise RuntimeError("No beacon energy detected")
+
+    t_start = (first[0] / sr) + MIN_BEACON_DURATION
+    t_end = ((w_start + last[-1]) / sr) - MIN_BEACON_DURATION
+    print(t_start, t_end)
 
+    if return_diagnostics:
+        return t_start, t_end, {"threshold": float(threshold),
+                                "envelopes": [(0.0, sr, env_begin), (w_start / sr, sr, env_end)]}
     return t_start, t_end
 
 # ==========================================================
-# VIDEO CROPPING (TIMESTAMP-BASED)
+# STREAMING BEACON DETECTION (CONSTANT MEMORY)
 # ==========================================================
 
-def crop_video(video_path, output_path, t_start, t_end):
-    subprocess.run(
-        [
-            "ffmpeg",
-            "-y",
-            "-ss", f"{t_start:.6f}",
-            "-to", f"{t_end:.6f}",
-            "-i", video_path,
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-crf", "18",
-            "-pix_fmt", "yuv420p",
-            "-c:a", "copy",
-            output_path
-        ],
-        check=True
-    )
+class StreamingBeaconDetector:
+    """
+    Block-wise version of detect_beacons() for arbitrarily long recordings.
+
+    Each block goes through a stateful (SOS) band-pass; the band energy is
+    averaged per 'hop' samples into an envelope. Instead of the full envelope
+    only two short candidate lists are kept, which is enough to answer
+    "first/last hop above THRESHOLD_RATIO * max" once the stream ends:
+      - rising records (hops louder than every earlier hop) -> first crossing
+      - falling records (hops louder than every later hop)  -> last crossing
+    Entries at or below the current threshold can never be the answer (the
+    threshold only grows), so both lists are pruned to roughly the beacon length.
+    """
+
+    def __init__(self, sr, center=BEACON_FREQ, freq_bandwidth=BEACON_BW,
+                 hop=STREAM_HOP, threshold_ratio=THRESHOLD_RATIO):
+        nyq = sr * 0.5
+        band = [(center - freq_bandwidth) / nyq, (center + freq_bandwidth) / nyq]
+        self.sos = butter(4, band, btype="band", output="sos")
+        self.zi = np.zeros((self.sos.shape[0], 2))
+
+        # Causal filter delays the envelope by its group delay at the beacon frequency
+        b, a = butter(4, band, btype="band")
+        self.delay = float(group_delay((b, a), w=[center], fs=sr)[1][0])
+
+        self.sr = sr
+        self.hop = hop
+        self.threshold_ratio = threshold_ratio
+
+        self._partial = np.zeros(0)   # band energy of the unfinished hop
+        self.n_hops = 0
+        self.peak = 0.0
+        self._rising = deque()        # (hop, env), env increasing
+        self._falling = deque()       # (hop, env), env decreasing
+
+    def process(self, block):
+        filtered, self.zi = sosfilt(self.sos, np.asarray(block, dtype=np.float32), zi=self.zi)
+
+        energy = np.concatenate([self._partial, filtered * filtered])
+        n_full = energy.size // self.hop
+        self._partial = energy[n_full * self.hop:]
+        if n_full == 0:
+            return
+
+        # Per-hop RMS envelope (sqrt(2) -> sine amplitude, comparable to the Hilbert envelope)
+        env = np.sqrt(2.0 * energy[:n_full * self.hop].reshape(n_full, self.hop).mean(axis=1))
+        hops = self.n_hops + np.arange(n_full)
+        self.n_hops += n_full
+
+        # Rising records of this block
+        prev_max = self._rising[-1][1] if self._rising else self.peak
+        running = np.maximum.accumulate(np.concatenate([[prev_max], env]))[:-1]
+        for i in np.where(env > running)[0]:
+            self._rising.append((int(hops[i]), float(env[i])))
+
+        # Falling records of this block replace older ones that are not louder
+        block_max = float(env.max())
+        while self._falling and self._falling[-1][1] <= block_max:
+            self._falling.pop()
+        suffix_max = np.maximum.accumulate(env[::-1])[::-1]
+        later_max = np.concatenate([suffix_max[1:], [-np.inf]])
+        for i in np.where(env > later_max)[0]:
+            self._falling.append((int(hops[i]), float(env[i])))
+
+        # Drop candidates that can no longer cross the (growing) threshold
+        self.peak = max(self.peak, block_max)
+        threshold = self.threshold
+        while self._rising and self._rising[0][1] <= threshold:
+            self._rising.popleft()
+        while self._falling and self._falling[-1][1] <= threshold:
+            self._falling.pop()
+
+    @property
+    def threshold(self):
+        # Envelope level the first/last crossings are measured against (so far)
+        return self.threshold_ratio * self.peak
+
+    def result(self):
+        if not self._rising or not self._falling:
+            raise RuntimeError("No beacon energy detected")
+
+        # First/last above-threshold sample, compensated for the causal filter delay
+        first = self._rising[0][0] * self.hop - self.delay
+        last = (self._falling[-1][0] + 1) * self.hop - 1 - self.delay
+
+        t_start = (first / self.sr) + MIN_BEACON_DURATION # BEGIN beacon timestamp
+        t_end = (last / self.sr) - MIN_BEACON_DURATION    # END beacon timestamp
+        return t_start, t_end
+
+def detect_beacons_streaming(blocks, sr, hop=STREAM_HOP, return_diagnostics=False):
+    """
+    :param blocks: iterable of PCM blocks, e.g. media_reader.iter_audio_blocks()
+    :return: (t_start, t_end), as detect_beacons(); with return_diagnostics the
+             threshold is reported but no envelope (it is never held in full)
+    """
+    detector = StreamingBeaconDetector(sr, hop=hop)
+    for block in blocks:
+        detector.process(block)
+
+    t_start, t_end = detector.result()
+    print(t_start, t_end)
+
+    if return_diagnostics:
+        return t_start, t_end, {"threshold": float(detector.threshold), "envelopes": []}
+    return t_start, t_end
 
 # ==========================================================
-# MAIN PIPELINE
+# NARROWBAND BEACON DETECTION (HETERODYNE + DECIMATION)
 # ==========================================================
 
-def main():
-    print("Extracting audio...")
-    extract_audio(VIDEO_PATH, TEMP_AUDIO)
+def narrowband_envelope(audio, sr, freq, hop):
+    # Amplitude at 'freq' once per hop: each hop is Hann-weighted and mixed down
+    # by a single complex exponential (one DFT bin, ~2*sr/hop Hz wide), i.e. a
+    # heterodyne + low-pass + decimate-by-hop in one matrix product.
+    # Real/imag parts are separate float32 dot products: no full-length complex array
+    n = len(audio) // hop
+    blocks = np.asarray(audio[:n * hop], dtype=np.float32).reshape(n, hop)
 
-    print("Loading audio...")
-    audio, sr = load_wav(TEMP_AUDIO)
+    w = np.hanning(hop)
+    phase = 2.0 * np.pi * freq * np.arange(hop) / sr
+    mixer = np.stack([w * np.cos(phase), w * np.sin(phase)], axis=1).astype(np.float32)
 
+    iq = blocks @ mixer
+    return np.hypot(iq[:, 0], iq[:, 1]) * (2.0 / w.sum())
+
+def detect_beacons_narrowband(audio, sr, hop=NARROWBAND_HOP, return_diagnostics=False):
+    # Same contract as detect_beacons(), envelope at sr/hop instead of sr
+    env = narrowband_envelope(audio, sr, BEACON_FREQ, hop)
+
+    threshold = THRESHOLD_RATIO * np.max(env)
+    indices = np.where(env > threshold)[0]
+    if len(indices) == 0:
+        raise RuntimeError("No beacon energy detected")
+
+    # Each envelope value describes the centre of its hop
+    first = indices[0] * hop + hop // 2
+    last = indices[-1] * hop + hop // 2
+
+    t_start = (first / sr) + MIN_BEACON_DURATION # BEGIN beacon timestamp
+    t_end = (last / sr) - MIN_BEACON_DURATION    # END beacon timestamp
+    print(t_start, t_end)
+
+    if return_diagnostics:
+        return t_start, t_end, {"threshold": float(threshold), "envelopes": [((hop // 2) / sr, sr / hop, env)]}
+    return t_start, t_end
+
+# ==========================================================
+# COARSE-TO-FINE BEACON DETECTION
+# ==========================================================
+
+def detect_beacons_coarse_fine(audio, sr, coarse_hop=COARSE_HOP, pad_sec=REFINE_PAD_SEC,
+                               return_diagnostics=False):
+    # Stage 1: first/last beacon hop on the decimated narrowband envelope
+    env_coarse = narrowband_envelope(audio, sr, BEACON_FREQ, coarse_hop)
+    coarse = np.where(env_coarse > THRESHOLD_RATIO * np.max(env_coarse))[0]
+    if len(coarse) == 0:
+        raise RuntimeError("No beacon energy detected")
+
+    # Stage 2: full-rate band-pass + Hilbert envelope only around the two edges
+    margin = 2 * coarse_hop + int(round(pad_sec * sr))
+
+    def _window(hop_index):
+        start = max(0, hop_index * coarse_hop - margin)
+        end = min(len(audio), (hop_index + 1) * coarse_hop + margin)
+        return start, envelope(bandpass(audio[start:end], sr, BEACON_FREQ, BEACON_BW))
+
+    begin_start, env_begin = _window(coarse[0])
+    end_start, env_end = _window(coarse[-1])
+
+    # Both windows reach into the beacon plateau, so their peak stands in for the global one
+    threshold = THRESHOLD_RATIO * max(np.max(env_begin), np.max(env_end))
+    first = np.where(env_begin > threshold)[0]
+    last = np.where(env_end > threshold)[0]
+    if len(first) == 0 or len(last) == 0:
+        raise RuntimeError("No beacon energy detected")
+
+    t_start = ((begin_start + first[0]) / sr) + MIN_BEACON_DURATION # BEGIN beacon timestamp
+    t_end = ((end_start + last[-1]) / sr) - MIN_BEACON_DURATION     # END beacon timestamp
+    print(t_start, t_end)
+
+    if return_diagnostics:
+        return t_start, t_end, {"threshold": float(threshold),
+                                "envelopes": [(begin_start / sr, sr, env_begin), (end_start / sr, sr, env_end)]}
+    return t_start, t_end
+
+# ==========================================================
+# MAIN PIPELINE
+# ==========================================================
+
+def locate_beacons(video_path, detector=BEACON_DETECTOR, timeline_path=TIMELINE_PATH,
+                   threads=None, plot=True):
+    """
+    Decodes the audio of one video and runs the selected beacon detector.
+
+    :return: (t_start, t_end, diagnostics) — the envelope(s) and threshold of the
+             detector that ran (see plot_beacon_diagnostics; no envelope for streaming)
+    """
+    if detector == "streaming":
+        # Decoded PCM is consumed block by block, never held in full
+        blocks = iter_audio_blocks(video_path, STREAM_BLOCK_SAMPLES, SAMPLE_RATE, threads=threads)
+        return detect_beacons_streaming(blocks, SAMPLE_RATE, return_diagnostics=True)
+
+    # Decoded straight from the video (no temporary WAV), int16 values as float32
+    audio = to_float32(read_audio(video_path, SAMPLE_RATE, threads=threads), normalize=False)
+    sr = SAMPLE_RATE
+
+    if detector == "narrowband":
+        return detect_beacons_narrowband(audio, sr, return_diagnostics=True)
+    if detector == "coarse_fine":
+        return detect_beacons_coarse_fine(audio, sr, return_diagnostics=True)
+    if timeline_path:
+        return detect_beacons_windowed(audio, sr, timeline_path, return_diagnostics=True)
+    return detect_beacons(audio, sr, plot=plot, return_diagnostics=True)
+
+def main():
     print("Detecting beacons...")
-    t_start, t_end = detect_beacons(audio, sr)
-    # detect_beacons(audio, sr)
+    t_start, t_end, _ = locate_beacons(VIDEO_PATH)
 
     print(f"Cropping video from {t_start:.3f}s to {t_end:.3f}s")
     crop_video(VIDEO_PATH, OUTPUT_VIDEO, t_start, t_end)
 
     print("Done. Cropped video written to:", OUTPUT_VIDEO)
 
+# ==========================================================
+# BATCH MODE (HEADLESS, PARALLEL)
+# ==========================================================
+
+VIDEO_EXTS = (".mov", ".mp4", ".m4v", ".mkv", ".avi")
+
+def collect_videos(inputs):
+    # Directories (all videos inside), globs or plain file paths
+    videos = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "*"))
+        else:
+            matches = glob.glob(item)
+        videos += [m for m in matches if m.lower().endswith(VIDEO_EXTS)]
+    return sorted(set(videos))
+
+def process_video(video_path, output_dir, detector=BEACON_DETECTOR, timeline_path=TIMELINE_PATH,
+                  crop=True, plot_dir=None, threads=None, crop_mode=CROP_MODE):
+    """
+    Beacon detection + crop for one video, never raises.
+
+    :return: JSON-serializable record (t_start, t_end, threshold, timings, status)
+    """
+    name = os.path.basename(video_path)
+    record = {"video": video_path, "detector": detector, "status": "ok"}
+    timings = {}
+
+    try:
+        t0 = time.perf_counter()
+        t_start, t_end, diagnostics = locate_beacons(video_path, detector, timeline_path, threads, plot=False)
+        timings["detect"] = time.perf_counter() - t0
+        record.update(t_start=float(t_start), t_end=float(t_end))
+        if t_end <= t_start:
+            raise RuntimeError("Empty crop window: END beacon not found after BEGIN beacon")
+
+        # Threshold and envelope(s) of the detector that actually ran
+        record["threshold"] = diagnostics["threshold"]
+        if plot_dir and diagnostics["envelopes"]:
+            plot_path = os.path.join(plot_dir, os.path.splitext(name)[0] + "_beacons.png")
+            plot_beacon_diagnostics(diagnostics, t_start, t_end, save_path=plot_path)
+            record["plot"] = plot_path
+
+        if crop:
+            output_path = os.path.join(output_dir, "crpd_" + name)
+            t0 = time.perf_counter()
+            if crop_mode == "virtual":
+                output_path = save_record(CropRecord.from_times(os.path.abspath(video_path), t_start, t_end, SAMPLE_RATE),
+                                          record_path(output_dir, video_path))
+                record["crop_mode"] = "virtual"
+            elif crop_mode == "smart":
+                # "smart", or "reencode" if the span holds too few whole GOPs
+                record["crop_mode"] = smart_cut(video_path, output_path, t_start, t_end, threads=threads)
+            else:
+                crop_video(video_path, output_path, t_start, t_end, threads=threads)
+                record["crop_mode"] = "reencode"
+            timings["crop"] = time.perf_counter() - t0
+            record["output"] = output_path
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+
+    record["timings"] = {k: round(v, 3) for k, v in timings.items()}
+    return record
+
+def _init_worker():
+    # Workers never open windows
+    plt.switch_backend("Agg")
+
+def run_batch(videos, output_dir, report_path, workers=None, threads_per_worker=None,
+              detector=BEACON_DETECTOR, timeline_path=TIMELINE_PATH, crop=True, plot_dir=None,
+              crop_mode=CROP_MODE):
+    """
+    Crops many videos in a bounded process pool. Each finished video is
+    appended to 'report_path' (JSONL) right away, so partial runs keep their results.
+    """
+    workers = workers or max(1, min(len(videos), os.cpu_count() or 1))
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    os.makedirs(output_dir, exist_ok=True)
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+
+    records = []
+    with open(report_path, "a") as report, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(process_video, video, output_dir, detector, timeline_path,
+                               crop, plot_dir, threads, crop_mode) for video in videos]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            report.write(json.dumps(record) + "\n")
+            report.flush()
+            print(f"[{record['status'].upper()}] {record['video']}")
+
+    return records
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Beacon-based cropping of many raw videos (headless).")
+    p.add_argument("inputs", nargs="+", help="video files, directories or glob patterns")
+    p.add_argument("--output-dir", required=True, help="cropped videos go here as crpd_<name>")
+    p.add_argument("--report", default="protocol_cropping_report.jsonl", help="JSONL report (appended)")
+    p.add_argument("--workers", type=int, default=None, help="parallel videos (default: all cores)")
+    p.add_argument("--threads-per-worker", type=int, default=None,
+                   help="ffmpeg -threads per worker (default: cores // workers)")
+    p.add_argument("--detector", default=BEACON_DETECTOR,
+                   choices=["full", "streaming", "narrowband", "coarse_fine"])
+    p.add_argument("--timeline", default=TIMELINE_PATH, help="protocol .timeline.json (full detector)")
+    p.add_argument("--no-crop", action="store_true", help="only detect and report")
+    p.add_argument("--crop-mode", default=CROP_MODE, choices=["reencode", "smart", "virtual"],
+                   help="smart: copy whole GOPs, re-encode only the boundary GOPs; "
+                        "virtual: write a .crop.json record instead of a video")
+    p.add_argument("--plot-dir", default=None, help="write diagnostic envelope plots here")
+    return p.parse_args()
+
+def batch_main():
+    args = parse_args()
+    videos = collect_videos(args.inputs)
+    if not videos:
+        print("[ERROR]: NO VIDEOS FOUND!")
+        return 1
+
+    records = run_batch(videos, args.output_dir, args.report,
+                        workers=args.workers, threads_per_worker=args.threads_per_worker,
+                        detector=args.detector, timeline_path=args.timeline,
+                        crop=not args.no_crop, plot_dir=args.plot_dir, crop_mode=args.crop_mode)
+    failed = sum(r["status"] != "ok" for r in records)
+    print(f"Done: {len(records) - failed} ok, {failed} failed. Report: {args.report}")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    # No arguments: single hard-coded VIDEO_PATH as before; otherwise batch CLI
+    if len(sys.argv) > 1:
+        sys.exit(batch_main())
     main()
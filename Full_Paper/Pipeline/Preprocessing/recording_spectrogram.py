@@ -0,0 +1,210 @@
+import json
+import math
+import os
+import numpy as np
+
+from crop_records import as_record
+from media_reader import iter_audio_blocks, to_float32
+from stft_batch import TOP_DB, band_magnitudes, band_plan, frame_view, num_frames, power_db, window_offset
+
+# ==========================================================
+# WHOLE-RECORDING SPECTROGRAM (ONE PASS, SEGMENTS AS SLICES)
+# ==========================================================
+# The band spectrogram of a whole (cropped) recording, computed while its
+# audio streams out of ffmpeg and appended to disk:
+#   <store>.spec       raw float32, shape (T, F_band): frame t is centred on
+#                      sample t * hop_length (librosa.stft center=True)
+#   <store>.peak.npy   (T,) peak dB of each frame over the full spectrum
+#                      ("zoom" backend: over the band)
+#   <store>.json       STFT parameters, band frequencies, segment grid
+# With segment_sec * sampling_rate a multiple of hop_length, segment k of the
+# fast_split grid (2 s = 400 hops) is columns [400k, 400k + 401) of the
+# recording spectrogram: store.segment(k) is a zero-copy (F_band, 401)
+# view, no segment WAV is needed. Frames near a segment edge see the
+# neighbouring audio instead of librosa's zero padding, so only the first
+# and last column differ from a per-segment STFT.
+# dB values are stored before the top_db floor, which librosa applies per
+# segment (relative to the segment peak): segment(k, top_db=True) applies
+# it, which costs a copy.
+
+BLOCK_SAMPLES = 1 << 18   # decoded samples per pipe read (~5.5 s at 48 kHz)
+FRAME_BATCH = 2048        # frames per FFT call (bounds the complex intermediate)
+
+def store_paths(path):
+    base = path[:-len(".json")] if path.endswith(".json") else path
+    return base + ".spec", base + ".peak.npy", base + ".json"
+
+def recording_name(audio):
+    # Segment name prefix fast_split uses: record name / file base name (None for PCM)
+    if isinstance(audio, np.ndarray):
+        return None
+    record = as_record(audio)
+    return record.name if record is not None else os.path.splitext(os.path.basename(audio))[0]
+
+def _blocks_of(audio, sampling_rate, threads=None):
+    """
+    :param audio: video / audio file, CropRecord / .crop.json, or PCM in memory
+    :return: iterable of int16 or float blocks
+    """
+    if isinstance(audio, np.ndarray):
+        return [audio]
+    record = as_record(audio)
+    if record is not None:
+        return iter_audio_blocks(record.source, BLOCK_SAMPLES, sampling_rate,
+                                 start=record.t_start, duration=record.duration, threads=threads)
+    return iter_audio_blocks(audio, BLOCK_SAMPLES, sampling_rate, threads=threads)
+
+def write_recording_spectrogram(
+        audio,
+        path: str,
+        sampling_rate: int,
+        n_fft: int = 2048,
+        hop_length: int = 240,
+        win_length: int = 480,
+        fmin: int = 15000,
+        fmax: int = 19200,
+        segment_sec: float = 2.0,
+        backend: str = "rfft",
+        num_bins: int = None,
+        name: str = None,
+        threads: int = None,
+        workers: int = -1):
+    """
+    Streams 'audio' through the band STFT into a store at 'path'.
+
+    :param audio: video / audio file, CropRecord / .crop.json (span of the
+                  original recording), or PCM in memory (int16 or float)
+    :param segment_sec: SEGMENT GRID (fast_split: 2.0), must be a whole number of hops
+    :param backend, num_bins: see stft_batch.band_plan()
+    :param name: segment name prefix, DEFAULT: record name / file base name
+    :return: number of frames written
+    """
+    segment_samples = int(round(segment_sec * sampling_rate))
+    if segment_samples % hop_length:
+        raise ValueError(f"{segment_sec:g} s is not a whole number of {hop_length}-sample hops")
+
+    plan = band_plan(sampling_rate, n_fft, win_length, fmin, fmax, backend, num_bins)
+    blocks = _blocks_of(audio, sampling_rate, threads)
+    spec_path, peak_path, manifest_path = store_paths(path)
+
+    pad = n_fft // 2
+    offset = window_offset(n_fft, win_length)
+    buf = np.zeros(pad, dtype=np.float32)   # padded signal from sample buf_start on
+    buf_start = 0                           # (padded coordinates)
+    next_frame = 0
+    n_samples = 0
+    peaks = []
+
+    def flush(available_frames):
+        # Writes frames next_frame .. available_frames - 1, drops the samples before the next one
+        nonlocal buf, buf_start, next_frame
+        for lo in range(next_frame, available_frames, FRAME_BATCH):
+            n = min(FRAME_BATCH, available_frames - lo)
+            frames = frame_view(buf[lo * hop_length - buf_start:], hop_length, win_length, offset, n)
+            band_mag, frame_peak = band_magnitudes(frames, plan, workers)
+            power_db(band_mag).astype(np.float32).tofile(out)
+            peaks.append(power_db(frame_peak).astype(np.float32))
+        next_frame = max(next_frame, available_frames)
+        buf = buf[next_frame * hop_length - buf_start:]
+        buf_start = next_frame * hop_length
+
+    with open(spec_path, "wb") as out:
+        for block in blocks:
+            y = to_float32(block) if block.dtype == np.int16 else np.asarray(block, dtype=np.float32)
+            n_samples += y.size
+            buf = np.concatenate([buf, y])
+            # frame j needs padded samples up to j * hop + offset + win_length
+            ready = (buf_start + buf.size - offset - win_length) // hop_length + 1
+            flush(max(ready, next_frame))
+
+        # End of the recording: librosa's right zero padding, then the remaining frames
+        buf = np.concatenate([buf, np.zeros(pad, dtype=np.float32)])
+        total = num_frames(n_samples, hop_length)
+        flush(total)
+
+    np.save(peak_path, np.concatenate(peaks) if peaks else np.zeros(0, dtype=np.float32))
+    with open(manifest_path, "w") as f:
+        json.dump({
+            "name": name or recording_name(audio) or os.path.basename(path),
+            "sampling_rate": sampling_rate,
+            "n_fft": n_fft,
+            "hop_length": hop_length,
+            "win_length": win_length,
+            "fmin": fmin,
+            "fmax": fmax,
+            "backend": backend,
+            "top_db": TOP_DB,
+            "band_freqs": plan["band_freqs"].tolist(),
+            "num_samples": n_samples,
+            "num_frames": total,
+            "segment_samples": segment_samples,
+        }, f, indent=2)
+    return total
+
+# ==========================================================
+# READER
+# ==========================================================
+
+class RecordingSpectrogram:
+    """
+    Read-only view of a store. store.spec is the (T, F_band) memmap,
+    store.segment(k) the (F_band, frames) spectrogram of segment k.
+    """
+
+    def __init__(self, path):
+        spec_path, peak_path, manifest_path = store_paths(path)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self.freqs = np.array(self.manifest["band_freqs"])
+        self.hop_length = self.manifest["hop_length"]
+        self.segment_samples = self.manifest["segment_samples"]
+        self.peak_db = np.load(peak_path)
+        shape = (self.manifest["num_frames"], self.freqs.size)
+        if shape[0]:
+            self.spec = np.memmap(spec_path, dtype=np.float32, mode="r", shape=shape)
+        else:
+            self.spec = np.zeros(shape, dtype=np.float32)
+
+    def __len__(self):
+        # segments on the grid (the last one may be shorter)
+        return math.ceil(self.manifest["num_samples"] / self.segment_samples)
+
+    def columns(self, k):
+        """
+        :return: (first frame, number of frames) of segment k, the frames a
+                 center=True STFT of that segment alone would have
+        """
+        length = min(self.segment_samples, self.manifest["num_samples"] - k * self.segment_samples)
+        return k * self.segment_samples // self.hop_length, num_frames(length, self.hop_length)
+
+    def segment(self, k, top_db=False):
+        """
+        :param top_db: True -> librosa's floor (segment peak - top_db), as a copy
+        :return: (F_band, frames) float32 dB; a zero-copy view without top_db
+        """
+        if not 0 <= k < len(self):
+            raise IndexError(f"segment {k} out of range ({len(self)} segments)")
+        first, n = self.columns(k)
+        view = self.spec[first:first + n].T
+        if not top_db:
+            return view
+        floor = self.peak_db[first:first + n].max() - self.manifest["top_db"]
+        return np.maximum(view, floor)
+
+    def name(self, k):
+        # <recording>_seg%03d, the file name the segment muxer would have used
+        return f"{self.manifest['name']}_seg{k:03d}"
+
+    def export_segments(self, out_dir):
+        """
+        Writes every segment (with the top_db floor) as <name>_seg%03d.npy, named
+        like the per-segment STFT output (keep them apart: edge columns differ).
+
+        :return: list of written paths
+        """
+        paths = []
+        for k in range(len(self)):
+            path = os.path.join(out_dir, self.name(k) + ".npy")
+            np.save(path, np.ascontiguousarray(self.segment(k, top_db=True), dtype=np.float32))
+            paths.append(path)
+        return paths
@@ -0,0 +1,268 @@
+import json
+import os
+import numpy as np
+
+from crop_records import as_record, record_identity
+from media_reader import iter_audio_blocks
+from stage_manifest import StageManifest
+
+# ==========================================================
+# SEGMENT STORE (ONE INT16 MEMMAP + OFFSET INDEX)
+# ==========================================================
+# Replaces thousands of <name>_seg%03d.wav files by three files:
+#   <store>.pcm        raw int16 mono PCM of every recording, back to back
+#   <store>.index.npy  one row per segment (video id, segment index, start
+#                      sample, length, label)
+#   <store>.json       sample rate, segment length, video names and sources,
+#                      label map
+# Readers memory-map the PCM: a segment is a zero-copy int16 view, no file
+# is opened per segment. Segments sit on an exact segment_sec grid (the
+# fast_split segment muxer cuts at packet boundaries, a few ms later).
+# update_store() keeps a store in sync with a list of recordings: only new
+# or changed ones are decoded and appended (StageManifest); the rows of a
+# replaced recording are dropped, its PCM stays behind as unreferenced
+# samples until the store is rebuilt.
+
+INDEX_DTYPE = np.dtype([
+    ("video", np.int32),     # position in manifest["videos"]
+    ("segment", np.int32),   # index within the recording (_seg%03d)
+    ("start", np.int64),     # first sample in <store>.pcm
+    ("length", np.int32),    # samples (the last segment of a recording may be shorter)
+    ("label", np.int8),      # LABEL_MAP value, -1 = unknown
+])
+
+# Same classes and name patterns as test.py's get_sample_labels()
+LABEL_MAP = {
+    "control": 0,
+    "0p": 1,
+    "50p": 2,
+    "100p": 3
+}
+
+def infer_label(name):
+    for key in ("100p", "50p", "0p", "control"):
+        if f"_{key}_" in name:
+            return LABEL_MAP[key]
+    return -1
+
+def store_paths(path):
+    base = path[:-len(".json")] if path.endswith(".json") else path
+    return base + ".pcm", base + ".index.npy", base + ".json"
+
+# ==========================================================
+# WRITER
+# ==========================================================
+
+class SegmentStoreWriter:
+    """
+    Appends recordings to a store; index and manifest are written by close().
+
+        with SegmentStoreWriter("dataset") as store:
+            for video in videos:
+                store.add_video(video)
+
+    append=True continues an existing store (same sample rate and segment
+    length) instead of truncating it.
+    """
+
+    def __init__(self, path, sample_rate=48000, segment_sec=2.0, block_samples=1 << 18, append=False):
+        self.pcm_path, self.index_path, self.manifest_path = store_paths(path)
+        self.sample_rate = sample_rate
+        self.segment_samples = int(round(segment_sec * sample_rate))
+        self.block_samples = block_samples
+        self.videos = []
+        self.sources = []
+        self._rows = []
+        self._n_samples = 0
+
+        if append and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if (manifest["sample_rate"], manifest["segment_samples"]) != (sample_rate, self.segment_samples):
+                raise ValueError(f"{self.manifest_path} holds {manifest['sample_rate']} Hz / "
+                                 f"{manifest['segment_samples']}-sample segments")
+            self.videos = manifest["videos"]
+            self.sources = manifest.get("sources", [None] * len(self.videos))
+            self._rows = [np.load(self.index_path)]
+            self._n_samples = manifest["num_samples"]
+            self._pcm = open(self.pcm_path, "r+b" if os.path.exists(self.pcm_path) else "wb")
+            self._pcm.truncate(2 * self._n_samples)   # drop samples of an interrupted writer
+            self._pcm.seek(0, os.SEEK_END)
+        else:
+            self._pcm = open(self.pcm_path, "wb")
+
+    def remove(self, name):
+        """
+        Drops the rows of recording 'name' (its samples stay in <store>.pcm,
+        unreferenced); the name can then be added again.
+
+        :return: number of segments removed
+        """
+        if name not in self.videos:
+            return 0
+        video = self.videos.index(name)
+        self.videos[video] = None
+        self.sources[video] = None
+        rows = np.concatenate(self._rows) if self._rows else np.zeros(0, dtype=INDEX_DTYPE)
+        keep = rows["video"] != video
+        self._rows = [rows[keep]]
+        return int((~keep).sum())
+
+    def add_pcm(self, name, blocks, label=None, source=None):
+        """
+        :param blocks: int16 array, or iterable of int16 blocks (streamed to disk)
+        :param label: DEFAULT: infer_label(name)
+        :param source: JSON-serializable origin of the PCM (kept in the manifest)
+        :return: number of segments added
+        """
+        if isinstance(blocks, np.ndarray):
+            blocks = [blocks]
+        self.remove(name)
+
+        start = self._n_samples
+        for block in blocks:
+            np.ascontiguousarray(block, dtype=np.int16).tofile(self._pcm)
+            self._n_samples += len(block)
+
+        video = len(self.videos)
+        self.videos.append(name)
+        self.sources.append(source)
+        label = infer_label(name) if label is None else label
+
+        offsets = np.arange(start, self._n_samples, self.segment_samples, dtype=np.int64)
+        rows = np.zeros(offsets.size, dtype=INDEX_DTYPE)
+        rows["video"] = video
+        rows["segment"] = np.arange(offsets.size)
+        rows["start"] = offsets
+        rows["length"] = np.minimum(self.segment_samples, self._n_samples - offsets)
+        rows["label"] = label
+        self._rows.append(rows)
+        return offsets.size
+
+    def add_video(self, video_path, label=None, threads=None):
+        """
+        Decodes a video (or the span of a crop record) straight into the store.
+        """
+        name, source, span, _ = record_identity(video_path)
+        record = as_record(video_path)
+        if record is not None:
+            blocks = iter_audio_blocks(record.source, self.block_samples, self.sample_rate,
+                                       start=record.t_start, duration=record.duration, threads=threads)
+        else:
+            blocks = iter_audio_blocks(video_path, self.block_samples, self.sample_rate, threads=threads)
+        return self.add_pcm(name, blocks, label, source={"path": os.path.abspath(source), "span": span})
+
+    def close(self):
+        self._pcm.close()
+        index = np.concatenate(self._rows) if self._rows else np.zeros(0, dtype=INDEX_DTYPE)
+        np.save(self.index_path, index)
+        with open(self.manifest_path, "w") as f:
+            json.dump({
+                "sample_rate": self.sample_rate,
+                "segment_samples": self.segment_samples,
+                "num_samples": self._n_samples,
+                "videos": self.videos,
+                "sources": self.sources,
+                "label_map": LABEL_MAP,
+            }, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def update_store(path, videos, sample_rate=48000, segment_sec=2.0, manifest_path=None, threads=None,
+                 progress=None):
+    """
+    Brings the store at 'path' up to date with 'videos' (files or crop
+    records): new or changed recordings are decoded and appended, a changed
+    one replaces its older copy. A missing store, or one with another sample
+    rate / segment length, is rebuilt from scratch.
+
+    :param manifest_path: StageManifest JSON, DEFAULT: <store>.stage.json
+    :param progress: optional wrapper around the video iterable (e.g. tqdm)
+    :return: names of the (re)added recordings
+    """
+    manifest_path = manifest_path or os.path.splitext(store_paths(path)[2])[0] + ".stage.json"
+    manifest = StageManifest(manifest_path, "segment_store", {"sample_rate": sample_rate, "segment_sec": segment_sec})
+
+    try:
+        writer = SegmentStoreWriter(path, sample_rate, segment_sec, append=True)
+        if not os.path.exists(store_paths(path)[2]):
+            manifest.entries.clear()
+    except ValueError:
+        writer = SegmentStoreWriter(path, sample_rate, segment_sec)
+        manifest.entries.clear()
+
+    added = []
+    with writer:
+        for video in (progress(videos) if progress else videos):
+            name, source, span, key = record_identity(video)
+            extra = {"span": span} if span else None
+            if name in writer.videos and not manifest.needs_run(source, extra, key)[0]:
+                continue
+            writer.add_video(video, threads=threads)
+            manifest.record(source, [], extra, key)
+            added.append(name)
+    # Entries are saved only once the index lists their rows
+    manifest.save()
+    return added
+
+# ==========================================================
+# READER
+# ==========================================================
+
+class SegmentStore:
+    """
+    Read-only view of a store. store[i] is the int16 PCM of segment i
+    (a zero-copy memmap slice); store.index holds the matching rows.
+    """
+
+    def __init__(self, path):
+        pcm_path, index_path, manifest_path = store_paths(path)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self.sample_rate = self.manifest["sample_rate"]
+        self.videos = self.manifest["videos"]
+        self.sources = self.manifest.get("sources", [None] * len(self.videos))
+        self.index = np.load(index_path)
+        if self.manifest["num_samples"]:
+            self.pcm = np.memmap(pcm_path, dtype=np.int16, mode="r", shape=(self.manifest["num_samples"],))
+        else:
+            self.pcm = np.zeros(0, dtype=np.int16)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        row = self.index[i]
+        return self.pcm[row["start"]:row["start"] + row["length"]]
+
+    @property
+    def labels(self):
+        return self.index["label"]
+
+    def name(self, i):
+        # <video>_seg%03d, the file name the segment muxer would have used
+        row = self.index[i]
+        return f"{self.videos[row['video']]}_seg{row['segment']:03d}"
+
+    def source(self, i):
+        # {"path", "span"} the PCM of segment i was decoded from (None: added as raw PCM)
+        return self.sources[self.index[i]["video"]]
+
+    def segments_of(self, video):
+        """
+        :param video: name or id
+        :return: positions (into index / store[i]) of that recording's segments
+        """
+        vid = self.videos.index(video) if isinstance(video, str) else video
+        return np.flatnonzero(self.index["video"] == vid)
+
+    def recording(self, video):
+        # Whole recording as one zero-copy view
+        rows = self.index[self.segments_of(video)]
+        if rows.size == 0:
+            return self.pcm[:0]
+        return self.pcm[rows["start"][0]:rows["start"][-1] + rows["length"][-1]]
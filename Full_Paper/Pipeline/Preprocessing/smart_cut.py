@@ -0,0 +1,185 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+
+# ==========================================================
+# VIDEO CROPPING (TIMESTAMP-BASED, FULL RE-ENCODE)
+# ==========================================================
+
+def crop_video(video_path, output_path, t_start, t_end, threads=None):
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-nostdin",                       # safe to run in background workers
+            "-threads", str(threads or 0),   # 0 = ffmpeg decides
+            "-ss", f"{t_start:.6f}",
+            "-to", f"{t_end:.6f}",
+            "-i", video_path,
+            "-c:v", "libx264",
+            "-preset", "ultrafast",
+            "-crf", "18",
+            "-pix_fmt", "yuv420p",
+            "-threads", str(threads or 0),
+            "-c:a", "copy",
+            output_path
+        ],
+        check=True
+    )
+
+# ==========================================================
+# SMART-CUT CROPPING (COPY THE MIDDLE, RE-ENCODE THE EDGES)
+# ==========================================================
+#   [t_start ... k1) | [k1 ........... k2) | [k2 ... t_end)
+#     re-encoded     |   stream copy       |   re-encoded
+# k1/k2 = first/last keyframe inside the span. Only the two partial GOPs are
+# decoded and encoded, so the crop is frame-accurate at close to copy speed.
+# Parts are written as MPEG-TS (in-band SPS/PPS, so the re-encoded edges and
+# the camera's own bitstream can follow each other), byte-joined, then remuxed
+# together with the stream-copied audio of the span.
+
+# Source codec -> (encoder for the edges, bitstream filter for the copied middle)
+EDGE_CODECS = {
+    "h264": ("libx264", "h264_mp4toannexb"),
+    "hevc": ("libx265", "hevc_mp4toannexb"),
+}
+
+def probe_video_stream(video_path):
+    out = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=codec_name,pix_fmt,width,height,r_frame_rate",
+            "-of", "json",
+            video_path
+        ],
+        capture_output=True, check=True, text=True
+    ).stdout
+    return json.loads(out)["streams"][0]
+
+def probe_packets(video_path):
+    """
+    :return: (pts_time, is_keyframe) of every packet of the first video stream,
+             sorted by pts, from packet flags only (demux, no decode)
+    """
+    out = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=p=0",
+            video_path
+        ],
+        capture_output=True, check=True, text=True
+    ).stdout
+
+    times, key = [], []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(",")
+        if pts not in ("", "N/A"):
+            times.append(float(pts))
+            key.append("K" in flags)
+
+    order = np.argsort(times, kind="stable")
+    return np.asarray(times)[order], np.asarray(key, dtype=bool)[order]
+
+def _encode_part(video_path, output_ts, start, n_frames, stream, threads, crf, preset):
+    encoder, _ = EDGE_CODECS[stream["codec_name"]]
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-nostdin", "-v", "error",
+            "-threads", str(threads or 0),
+            "-ss", f"{start:.6f}",
+            "-i", video_path,
+            "-map", "0:v:0", "-an",
+            "-frames:v", str(n_frames),
+            "-c:v", encoder,
+            "-preset", preset,
+            "-crf", str(crf),
+            "-pix_fmt", stream["pix_fmt"],
+            "-threads", str(threads or 0),
+            "-f", "mpegts",
+            output_ts
+        ],
+        check=True
+    )
+
+def _copy_part(video_path, output_ts, start, n_frames, stream):
+    _, bsf = EDGE_CODECS[stream["codec_name"]]
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-nostdin", "-v", "error",
+            "-ss", f"{start:.6f}",     # start is a keyframe: input seek lands on it
+            "-i", video_path,
+            "-map", "0:v:0", "-an",
+            "-frames:v", str(n_frames),
+            "-c:v", "copy",
+            "-bsf:v", bsf,
+            "-avoid_negative_ts", "make_zero",
+            "-f", "mpegts",
+            output_ts
+        ],
+        check=True
+    )
+
+def smart_cut(video_path, output_path, t_start, t_end, threads=None, crf=18,
+              preset="ultrafast", min_copy_sec=1.0):
+    """
+    Frame-accurate crop of [t_start, t_end) that re-encodes only the boundary GOPs.
+
+    Falls back to a full re-encode of the span when the codec is not in
+    EDGE_CODECS or fewer than min_copy_sec of whole GOPs fit inside it.
+
+    :return: "smart" or "reencode" (which path was taken)
+    """
+    stream = probe_video_stream(video_path)
+    times, key = probe_packets(video_path)
+    inside = times[key & (times >= t_start) & (times <= t_end)]
+
+    if stream["codec_name"] not in EDGE_CODECS or len(inside) < 2 or inside[-1] - inside[0] < min_copy_sec:
+        crop_video(video_path, output_path, t_start, t_end, threads=threads)
+        return "reencode"
+
+    # Parts are bounded by frame counts (packets with pts in [a, b)), not by
+    # -to, so head + middle + tail hold exactly the frames of [t_start, t_end)
+    def n_frames(a, b):
+        return int(np.count_nonzero((times >= a) & (times < b)))
+
+    k1, k2 = float(inside[0]), float(inside[-1])
+    tmp = tempfile.mkdtemp(prefix="smart_cut_")
+    try:
+        parts = []
+        if n_frames(t_start, k1):
+            parts.append(os.path.join(tmp, "head.ts"))
+            _encode_part(video_path, parts[-1], t_start, n_frames(t_start, k1), stream, threads, crf, preset)
+
+        parts.append(os.path.join(tmp, "middle.ts"))
+        _copy_part(video_path, parts[-1], k1, n_frames(k1, k2), stream)
+
+        if n_frames(k2, t_end):
+            parts.append(os.path.join(tmp, "tail.ts"))
+            _encode_part(video_path, parts[-1], k2, n_frames(k2, t_end), stream, threads, crf, preset)
+
+        # TS is byte-joinable: the concat protocol (not the concat demuxer,
+        # which keeps the first part's codec parameters) lets each part carry
+        # its own SPS/PPS. Joined video + stream-copied audio of the same span.
+        subprocess.run(
+            [
+                "ffmpeg", "-y", "-nostdin", "-v", "error",
+                "-f", "mpegts", "-i", "concat:" + "|".join(parts),
+                "-ss", f"{t_start:.6f}",
+                "-to", f"{t_end:.6f}",
+                "-i", video_path,
+                "-map", "0:v:0", "-map", "1:a?",
+                "-c", "copy",
+                output_path
+            ],
+            check=True
+        )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return "smart"
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# ==========================================================
+# PER-STAGE MANIFEST (INCREMENTAL, CORRECT RERUNS)
+# ==========================================================
+# One JSON file per stage:
+#   {"stage": ..., "entries": {input: {"hash", "size", "mtime_ns", "params",
+#                                      "outputs": [{"path", "size"}, ...]}}}
+# An input is redone when it is new, its content hash or the stage params
+# changed, or any recorded output is missing / has another size. Entries are
+# written only after a run finished, so an interrupted run is redone too.
+# Hashes are reused while size and mtime are unchanged (no rehash of
+# unchanged multi-GB videos).
+# Long runs call checkpoint() per output: the whole manifest is rewritten at
+# most every SAVE_INTERVAL_SEC (and never for more than ~10% of the run), not
+# per output, which would be quadratic in the number of entries.
+# adopt() takes over outputs written before the stage had a manifest.
+
+HASH_CHUNK = 1 << 20
+SAVE_INTERVAL_SEC = 30.0
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _normalize(params):
+    # JSON round trip: tuples -> lists, numpy scalars must be converted by the caller
+    return json.loads(json.dumps(params, sort_keys=True))
+
+class StageManifest:
+    def __init__(self, path, stage, params):
+        """
+        :param path: MANIFEST JSON (created on first save)
+        :param stage: STAGE NAME, e.g. "fast_split"
+        :param params: JSON-serializable parameters the outputs depend on
+        """
+        self.path = path
+        self.stage = stage
+        self.params = _normalize(params)
+        self._lock = threading.Lock()
+        self._hashes = {}   # key -> (size, mtime_ns, hash) computed this session
+        self._last_save = time.monotonic()
+        self._save_seconds = 0.0
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("stage") == stage:
+                self.entries = data.get("entries", {})
+
+    @staticmethod
+    def key(input_path, key=None):
+        # Entries are keyed by the input file unless an explicit key is given
+        # (several entries hashing one file, e.g. segments of one recording)
+        return key or os.path.abspath(input_path)
+
+    def _hash(self, input_path, entry):
+        st = os.stat(input_path)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            return entry["hash"], st
+        key = os.path.abspath(input_path)
+        cached = self._hashes.get(key)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2], st
+        digest = file_hash(input_path)
+        self._hashes[key] = (st.st_size, st.st_mtime_ns, digest)
+        return digest, st
+
+    def _params(self, extra):
+        return self.params if not extra else _normalize({**self.params, **extra})
+
+    def needs_run(self, input_path, extra=None, key=None):
+        """
+        :param input_path: FILE WHOSE CONTENT IS HASHED
+        :param extra: per-input parameters (e.g. the span of a crop record)
+        :param key: ENTRY KEY, DEFAULT: absolute input_path
+        :return: (True, reason) or (False, "up to date")
+        """
+        with self._lock:
+            entry = self.entries.get(self.key(input_path, key))
+        if entry is None:
+            return True, "new"
+        if entry.get("params") != self._params(extra):
+            return True, "params changed"
+        digest, _ = self._hash(input_path, entry)
+        if digest != entry.get("hash"):
+            return True, "content changed"
+        for out in entry.get("outputs", []):
+            if not os.path.exists(out["path"]) or os.path.getsize(out["path"]) != out["size"]:
+                return True, "incomplete outputs"
+        return False, "up to date"
+
+    def invalidate(self, input_path, key=None):
+        # Forget the input and delete its recorded outputs (stale files of an older run)
+        with self._lock:
+            entry = self.entries.pop(self.key(input_path, key), None)
+        for out in (entry or {}).get("outputs", []):
+            if os.path.exists(out["path"]):
+                os.remove(out["path"])
+
+    def record(self, input_path, outputs, extra=None, key=None):
+        """
+        Marks 'input_path' done with the given output files (call after the run finished).
+        """
+        with self._lock:
+            previous = self.entries.get(self.key(input_path, key))
+        digest, st = self._hash(input_path, previous)
+        entry = {
+            "hash": digest,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "params": self._params(extra),
+            "outputs": [{"path": os.path.abspath(p), "size": os.path.getsize(p)} for p in sorted(outputs)],
+        }
+        with self._lock:
+            self.entries[self.key(input_path, key)] = entry
+
+    def adopt(self, input_path, outputs, extra=None, key=None):
+        """
+        Records 'input_path' as done with existing 'outputs' if it has no entry
+        yet (outputs of a run from before the manifest existed). The files are
+        trusted as they are: the caller checks they are complete.
+
+        :return: True if adopted
+        """
+        with self._lock:
+            if self.key(input_path, key) in self.entries:
+                return False
+        if not outputs or not all(os.path.exists(p) and os.path.getsize(p) > 0 for p in outputs):
+            return False
+        self.record(input_path, outputs, extra, key)
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        t0 = time.monotonic()
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"stage": self.stage, "entries": self.entries}, f, separators=(",", ":"))
+            os.replace(tmp, self.path)   # atomic: a crash never leaves a truncated manifest
+            self._last_save = time.monotonic()
+            self._save_seconds = self._last_save - t0
+
+    def checkpoint(self, min_interval=SAVE_INTERVAL_SEC):
+        """
+        save() if the last one is older than 'min_interval' seconds (and than
+        10x its own duration). Call save() once more when the stage is done.
+
+        :return: True if saved
+        """
+        if time.monotonic() - self._last_save < max(min_interval, 10.0 * self._save_seconds):
+            return False
+        self.save()
+        return True
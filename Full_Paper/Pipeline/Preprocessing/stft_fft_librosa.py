@@ -1,5 +1,28 @@
 import librosa
 import numpy as np
+from crop_records import as_record
+from media_reader import read_audio, to_float32
+
+def load_audio(audio_path, sampling_rate: int):
+    """
+    :param audio_path: .wav segment, a CropRecord / .crop.json (span decoded
+                       straight from the original recording), or PCM already in
+                       memory (e.g. a SegmentStore segment; int16 or float)
+    :return: float32 samples, scaled as librosa.load(); None for other files
+    """
+    if isinstance(audio_path, np.ndarray):
+        # int16 -> same float32 scaling as librosa.load()
+        return to_float32(audio_path) if audio_path.dtype == np.int16 else np.asarray(audio_path, dtype=np.float32)
+    if (record := as_record(audio_path)) is not None:
+        # Same float32 scaling as librosa.load() of an int16 segment
+        pcm = read_audio(record.source, sampling_rate, start=record.t_start, duration=record.duration)
+        return to_float32(pcm[:int(round(record.duration * sampling_rate))])
+    if ".wav" not in audio_path:
+        print("[ERROR]: 'audio_path' ONLY TAKES AUDIO FILES (.wav) OR CROP RECORDS!")
+        return None
+    # Loads audio clip (.wav)
+    y, sr = librosa.load(audio_path, sr=sampling_rate)
+    return y
 
 def compute_frequency_domain_spectrogram(
         audio_path: str,
@@ -11,7 +34,7 @@ def compute_frequency_domain_spectrogram(
         fmax: int = 19200): # DEFAULT: 19200
 
     """
-    :param audio_path:
+    :param audio_path: .wav segment, CropRecord / .crop.json or in-memory PCM (see load_audio)
     :param sampling_rate: AMPLITUDE SAMPLES PER SECOND
     :param n_fft:
     :param hop_length: OVERLAP
@@ -20,13 +43,10 @@ def compute_frequency_domain_spectrogram(
     :param fmax: UPPER FREQUENCY BOUND
     """
 
-    if ".wav" not in audio_path:
-        print("[ERROR]: 'audio_path' ONLY TAKES AUDIO FILES (.wav)!")
+    y = load_audio(audio_path, sampling_rate)
+    if y is None:
         return
 
-    # Loads audio clip (.wav)
-    y, sr = librosa.load(audio_path, sr=sampling_rate)
-
     # Computes Short-Time Fourier Transform (STFT) --> complex matrix
     S = librosa.stft(y, n_fft=n_fft, hop_length=hop_length, win_length=win_length)
 
@@ -1,6 +1,8 @@
 import numpy as np
-from scipy.signal import stft
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import get_window, stft
 import soundfile as sf
+from stft_batch import band_dft_matrix
 
 def compute_frequency_domain_spectrogram_scipy(
         audio_path: str,
@@ -9,8 +11,13 @@ def compute_frequency_domain_spectrogram_scipy(
         hop_length: int = 240,
         win_length: int = 480,
         fmin: float = 15000.0,
-        fmax: float = 19200.0
+        fmax: float = 19200.0,
+        zoom: bool = False
 ):
+    """
+    :param zoom: True -> only the [fmin, fmax] bins are computed (stft_batch
+                 band DFT), same values as slicing the full scipy STFT
+    """
 
     # reads audio file
     y, sr = sf.read(audio_path)
@@ -23,6 +30,17 @@ def compute_frequency_domain_spectrogram_scipy(
     if y.ndim > 1:
         y = y.mean(axis=1)
 
+    if zoom:
+        # same frames, window and 'spectrum' scaling as scipy.signal.stft below
+        f = np.fft.rfftfreq(n_fft, d=1.0 / sr)
+        freqs_ultra = f[(f >= fmin) & (f <= fmax)]
+        frames = sliding_window_view(y, win_length)[::hop_length]
+        parts = frames @ band_dft_matrix(freqs_ultra, sr, win_length).astype(frames.dtype)
+        S_ultra = np.hypot(parts[:, :freqs_ultra.size], parts[:, freqs_ultra.size:]).T
+        S_ultra /= get_window("hann", win_length).sum()
+        t = (win_length / 2 + hop_length * np.arange(frames.shape[0])) / sr
+        return S_ultra.astype(np.float32), freqs_ultra, t
+
     # computes stft ndarray
     # returns frequency axis, time axis, and complex frequency/time matrix
     f, t, Zxx = stft(
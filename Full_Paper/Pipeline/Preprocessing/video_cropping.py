@@ -1,38 +1,20 @@
 import os
+import sys
 import subprocess
 import librosa
 import numpy as np
-from scipy.signal import find_peaks
+from scipy.signal import find_peaks, butter, sosfiltfilt, hilbert
+from media_reader import read_audio, to_float32
 
-
-# ============================================================
-# 1. Extract audio from the (already cropped) video
-# ============================================================
-def extract_audio(video_path, sample_rate=48000):
-    base = os.path.splitext(video_path)[0]
-    wav_path = base + "_audio.wav"
-
-    subprocess.run([
-        "ffmpeg", "-y",
-        "-i", video_path,
-        "-vn",
-        "-acodec", "pcm_s16le",
-        "-ac", "1",
-        "-ar", str(sample_rate),
-        wav_path
-    ], check=True)
-
-    return wav_path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from waveform_templates import DEFAULT_BANK
 
 
 # ============================================================
-# 2. Detect chirp timestamps using Spectral Flux
+# 1. Detect chirp timestamps using Spectral Flux
 # ============================================================
-def detect_chirps(audio_path, sr=48000, n_fft=2048, hop=240,
-                  fmin=15000, fmax=19200):
-
-    y, _ = librosa.load(audio_path, sr=sr)
-
+def _band_flux(y, sr, n_fft, hop, fmin, fmax):
     # Full spec
     S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop))
 
@@ -44,22 +26,245 @@ def detect_chirps(audio_path, sr=48000, n_fft=2048, hop=240,
     S_ultra = S[band, :]   # <-- ONLY chirp energy
 
     # Spectral flux ON THE ULTRASONIC BAND ONLY
-    flux = np.sum((S_ultra[:, 1:] - S_ultra[:, :-1])**2, axis=0)
+    return np.sum((S_ultra[:, 1:] - S_ultra[:, :-1])**2, axis=0)
+
+
+def detect_chirps(audio_path, sr=48000, n_fft=2048, hop=240,
+                  fmin=15000, fmax=19200, windows=None):
+    """
+    :param audio_path: WAV path, or int16 PCM already decoded by media_reader.read_audio()
+    :param windows: optional [(start_sample, end_sample), ...] to search, e.g.
+                    protocol_timeline.search_windows() around the expected pulses;
+                    None searches the whole file
+    """
+
+    if isinstance(audio_path, np.ndarray):
+        y = to_float32(audio_path)
+    else:
+        y, _ = librosa.load(audio_path, sr=sr)
+
+    if windows is None:
+        windows = [(0, len(y))]
+
+    # Flux per window (frame 0 of each window sits at its start sample)
+    fluxes = [_band_flux(y[start:end], sr, n_fft, hop, fmin, fmax) for start, end in windows]
 
     # Threshold relative to ULTRASONIC energy, not whole spectrum
-    threshold = np.mean(flux) + 2 * np.std(flux)
+    all_flux = np.concatenate(fluxes)
+    threshold = np.mean(all_flux) + 2 * np.std(all_flux)
 
-    # Find peaks (one per sweep)
-    peaks, _ = find_peaks(flux, height=threshold, distance=20)
+    times = []
+    for (start, _), flux in zip(windows, fluxes):
+        # Find peaks (one per sweep)
+        peaks, _ = find_peaks(flux, height=threshold, distance=20)
 
-    # Convert frame index → time (seconds)
-    times = librosa.frames_to_time(peaks, sr=sr, hop_length=hop)
+        # Convert frame index → time (seconds)
+        times.append(start / sr + librosa.frames_to_time(peaks, sr=sr, hop_length=hop))
 
-    return times
+    return np.concatenate(times)
 
 
 # ============================================================
-# 3. Choose crop window using internal chirp indices
+# 2b. Coarse-to-fine chirp onsets
+# ============================================================
+def band_energy_blocks(y, sr, block, fmin, fmax):
+    # Coarse stage: one rfft per non-overlapping block, energy of the chirp band bins
+    n = len(y) // block
+    spec = np.fft.rfft(y[:n * block].reshape(n, block), axis=1)
+    freqs = np.fft.rfftfreq(block, d=1.0 / sr)
+    band = (freqs >= fmin) & (freqs <= fmax)
+    return np.sum(np.abs(spec[:, band])**2, axis=1)
+
+
+def detect_chirps_coarse_fine(audio_path, sr=48000, fmin=15000, fmax=19200,
+                              coarse_block=480, coarse_ratio=0.1, onset_ratio=0.5):
+    """
+    Two-stage chirp onset search:
+      1. band energy per 'coarse_block' samples (10 ms @ 48 kHz); each block where
+         it rises above coarse_ratio * (99th percentile) is an onset candidate
+      2. full-rate band-pass + Hilbert envelope in a few-block window around each
+         candidate; the onset is the first sample above onset_ratio * local peak
+
+    Only the candidate windows are processed at 48 kHz. Onsets are consistent to a
+    few samples; the fade-in and the 15 kHz band edge place them a constant few ms
+    after the nominal pulse start, which cancels out in compute_alignment_window().
+
+    :param audio_path: WAV path or int16 PCM (see detect_chirps)
+    :return: onset times (seconds)
+    """
+    if isinstance(audio_path, np.ndarray):
+        y = to_float32(audio_path)
+    else:
+        y, _ = librosa.load(audio_path, sr=sr)
+
+    # Stage 1 — decimated band energy, rising edges
+    energy = band_energy_blocks(y, sr, coarse_block, fmin, fmax)
+    if energy.size == 0:
+        return np.zeros(0)   # shorter than one block
+    active = energy > coarse_ratio * np.percentile(energy, 99)
+    candidates = np.where(active[1:] & ~active[:-1])[0] + 1
+    if active.size and active[0]:
+        candidates = np.concatenate([[0], candidates])
+    if len(candidates) == 0:
+        return np.zeros(0)
+
+    # Stage 2 — all candidate windows as one (n_candidates, W) array
+    W = min(4 * coarse_block, len(y))   # whole input when it is shorter than a window
+    starts = np.clip(candidates * coarse_block - 2 * coarse_block, 0, max(0, len(y) - W))
+    windows = y[starts[:, None] + np.arange(W)]
+
+    nyq = sr * 0.5
+    sos = butter(4, [fmin / nyq, min(fmax / nyq, 0.999)], btype="band", output="sos")
+    env = np.abs(hilbert(sosfiltfilt(sos, windows, axis=1), axis=1))
+
+    above = env > onset_ratio * env.max(axis=1, keepdims=True)
+    onsets = starts + np.argmax(above, axis=1)
+
+    return np.unique(onsets) / sr
+
+
+# ============================================================
+# 2c. Matched-filter chirp onsets (overlap-save FFT correlation)
+# ============================================================
+class MatchedChirpDetector:
+    """
+    Streams audio through a matched filter for the protocol chirp.
+
+    The template comes from the shared waveform_templates bank (same settings
+    as the generator). Correlation is done block-wise with overlap-save: each
+    FFT block of 'fft_size' samples yields fft_size - M new lags (M = template
+    length) and only M samples are carried over, so input length is unbounded.
+
+    Onsets are taken from the magnitude of the analytic correlation (smooth
+    envelope, no carrier ripple), normalized by the template and local signal
+    energy to a confidence in [0, 1] (lags quieter than 'min_rms' dBFS-scale RMS
+    score 0, so digital silence cannot match). Each run of scores above 'threshold' gives
+    one onset at its peak, refined by parabolic interpolation.
+    """
+
+    def __init__(self, sr=48000, fmin=15000, fmax=19200,
+                 pulse_duration=config.PULSE_DURATION, amplitude=config.AMPLITUDE,
+                 fade_ms=config.FADE_MS, threshold=0.5, min_rms=1e-4, fft_size=None):
+        template = DEFAULT_BANK.get(sr, fmin, fmax, pulse_duration, amplitude, fade_ms)
+        self.M = template.samples.size
+        self.N = fft_size or 1 << (4 * self.M - 1).bit_length()
+        self.L = self.N - self.M   # lags per block; lag L is also valid and used as look-ahead
+        self.H = DEFAULT_BANK.spectrum(template, self.N, conjugate=True)
+        self.h_norm = float(np.linalg.norm(template.samples))
+        self.min_energy = self.M * min_rms ** 2
+
+        self.sr = sr
+        self.threshold = threshold
+        self.min_gap = self.M // 2  # runs closer than this belong to the same pulse
+
+        self._buf = np.zeros(0, dtype=np.float32)
+        self._pos = 0               # absolute sample index of _buf[0]
+        self._prev_mag = 0.0
+        self._run = None            # [peak lag, peak score, y(-1), y(0), y(+1), last lag above]
+
+    def _correlate(self, seg):
+        # Analytic correlation: one-sided spectrum, doubled, inverse complex FFT
+        Y = np.fft.rfft(seg, n=self.N) * self.H
+        Z = np.zeros(self.N, dtype=np.complex128)
+        Z[:Y.size] = Y
+        Z[1:self.N // 2] *= 2.0
+        mag = np.abs(np.fft.ifft(Z)[:self.L + 1])
+
+        # Local energy under the template at every lag
+        cs = np.concatenate([[0.0], np.cumsum(seg.astype(np.float64) ** 2)])
+        energy = cs[self.M:self.M + self.L + 1] - cs[:self.L + 1]
+        score = mag / (self.h_norm * np.sqrt(np.maximum(energy, self.min_energy)))
+        score[energy < self.min_energy] = 0.0
+        return mag, np.minimum(score, 1.0)
+
+    def _finish_run(self, onsets):
+        lag, score, y_m, y_0, y_p, _ = self._run
+        denom = y_m - 2.0 * y_0 + y_p
+        delta = 0.5 * (y_m - y_p) / denom if denom < 0 else 0.0
+        onsets.append((lag + delta, score))
+        self._run = None
+
+    def _scan(self, mag, score, n_valid, onsets):
+        # mag/score hold n_valid lags + 1 look-ahead lag starting at self._pos, so
+        # every peak below n_valid has its right neighbour in this block
+        above = np.where(score[:n_valid] > self.threshold)[0]
+        if len(above) == 0:
+            return
+
+        # Split into runs separated by more than min_gap lags
+        breaks = np.where(np.diff(above) > self.min_gap)[0]
+        for first, last in zip(np.concatenate([[0], breaks + 1]), np.concatenate([breaks, [len(above) - 1]])):
+            idx = above[first:last + 1]
+            lag0 = self._pos + idx[0]
+            if self._run is not None and lag0 - self._run[5] > self.min_gap:
+                self._finish_run(onsets)
+
+            k = idx[np.argmax(score[idx])]
+            if self._run is None or score[k] > self._run[1]:
+                y_m = mag[k - 1] if k > 0 else self._prev_mag
+                self._run = [self._pos + k, float(score[k]), y_m, mag[k], mag[k + 1], 0]
+            self._run[5] = self._pos + idx[-1]
+
+    def process(self, block):
+        """
+        :return: list of (onset sample, confidence) finalized by this block
+        """
+        onsets = []
+        block = to_float32(block) if block.dtype == np.int16 else np.asarray(block, dtype=np.float32)
+        self._buf = np.concatenate([self._buf, block])
+        while self._buf.size >= self.N:
+            mag, score = self._correlate(self._buf[:self.N])
+            self._scan(mag, score, self.L, onsets)
+            self._prev_mag = mag[self.L - 1]
+            self._buf = self._buf[self.L:]
+            self._pos += self.L
+
+        # A run can only be closed once min_gap lags past it have been scanned
+        if self._run is not None and self._pos - self._run[5] > self.min_gap:
+            self._finish_run(onsets)
+        return onsets
+
+    def flush(self):
+        onsets = []
+        n_valid = self._buf.size - self.M + 1  # lags with the whole template inside the signal
+        if n_valid > 0:
+            seg = np.zeros(self.N, dtype=np.float32)
+            seg[:self._buf.size] = self._buf
+            mag, score = self._correlate(seg)
+            self._scan(mag[:n_valid + 1], score, n_valid, onsets)
+        if self._run is not None:
+            self._finish_run(onsets)
+        return onsets
+
+
+def detect_chirps_matched(audio, sr=48000, fmin=15000, fmax=19200,
+                          threshold=0.5, block_samples=1 << 16):
+    """
+    :param audio: WAV path, int16 PCM, float PCM in [-1, 1], or an iterable of
+                  such blocks (e.g. media_reader.iter_audio_blocks) for streaming
+    :return: (onset times in seconds with sub-sample precision, confidences)
+    """
+    if isinstance(audio, str):
+        audio, _ = librosa.load(audio, sr=sr)
+    if isinstance(audio, np.ndarray):
+        blocks = (audio[i:i + block_samples] for i in range(0, len(audio), block_samples))
+    else:
+        blocks = audio
+
+    detector = MatchedChirpDetector(sr=sr, fmin=fmin, fmax=fmax, threshold=threshold)
+    onsets = []
+    for block in blocks:
+        onsets += detector.process(block)
+    onsets += detector.flush()
+
+    if not onsets:
+        return np.zeros(0), np.zeros(0)
+    samples, scores = np.array(onsets).T
+    return samples / sr, scores
+
+
+# ============================================================
+# 2. Choose crop window using internal chirp indices
 # ============================================================
 def compute_alignment_window(chirp_times, start_idx=2, end_idx=-3):
     if len(chirp_times) < abs(end_idx):
@@ -75,7 +280,7 @@ def compute_alignment_window(chirp_times, start_idx=2, end_idx=-3):
 
 
 # ============================================================
-# 4. Crop video (copy streams, no re-encoding)
+# 3. Crop video (copy streams, no re-encoding)
 # ============================================================
 def crop_video(input_video, output_video, crop_start, crop_end):
     subprocess.run([
@@ -90,17 +295,23 @@ def crop_video(input_video, output_video, crop_start, crop_end):
 
 
 # ============================================================
-# 5. Full pipeline for one video
+# 4. Full pipeline for one video
 # ============================================================
-def align_video(video_path, start_idx=2, end_idx=-3):
+def align_video(video_path, start_idx=2, end_idx=-3, detector="flux"):
     print(f"\n=== Processing: {video_path} ===")
 
-    # Step A — Extract audio
-    audio_path = extract_audio(video_path)
-    print(f"Extracted audio: {audio_path}")
-
-    # Step B — Detect chirps
-    chirp_times = detect_chirps(audio_path)
+    # Step A — Decode audio in memory (no <video>_audio.wav)
+    audio = read_audio(video_path, sample_rate=48000)
+    print(f"Decoded audio: {audio.size / 48000:.1f} sec")
+
+    # Step B — Detect chirps ("flux": STFT spectral flux, "coarse_fine": two-stage onsets,
+    # "matched": matched filter)
+    if detector == "coarse_fine":
+        chirp_times = detect_chirps_coarse_fine(audio)
+    elif detector == "matched":
+        chirp_times, _ = detect_chirps_matched(audio)
+    else:
+        chirp_times = detect_chirps(audio)
     print(f"Detected {len(chirp_times)} chirps.")
     print("First few chirps (sec):", chirp_times[:5])
     print("Last few chirps (sec):", chirp_times[-5:])
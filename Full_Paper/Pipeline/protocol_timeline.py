@@ -0,0 +1,116 @@
+import json
+import os
+import numpy as np
+
+# ==========================================================
+# PROTOCOL TIMELINE MANIFEST
+# ==========================================================
+# Sidecar written next to a rendered protocol WAV:
+#   <name>.timeline.json -> settings, section summary, beacons/guards/silences
+#   <name>.timeline.npy  -> every event (incl. each chirp pulse) as a
+#                           structured (kind, start, length) array, in samples
+
+KINDS = ("silence", "beacon", "guard", "pulse")
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+TIMELINE_DTYPE = np.dtype([("kind", "u1"), ("start", "<i8"), ("length", "<i4")])
+
+def build_timeline(layout, pulse_samples, cycle_samples):
+    """
+    Expands the generator layout into sample-exact events.
+
+    :param layout: ordered (kind, n_samples) sections, kind in silence/beacon/guard/active
+    :param pulse_samples: SAMPLES PER CHIRP PULSE
+    :param cycle_samples: SAMPLES PER PULSE+GAP CYCLE
+    :return: structured array with TIMELINE_DTYPE, sorted by start
+    """
+    chunks = []
+    pos = 0
+    for kind, n in layout:
+        if kind == "active":
+            # One pulse per whole cycle, plus a truncated pulse in the residual
+            cycles_in_block = n // cycle_samples
+            residual = n - cycles_in_block * cycle_samples
+            n_pulses = cycles_in_block + (1 if residual else 0)
+
+            pulses = np.empty(n_pulses, dtype=TIMELINE_DTYPE)
+            pulses["kind"] = KIND_CODES["pulse"]
+            pulses["start"] = pos + np.arange(n_pulses, dtype=np.int64) * cycle_samples
+            pulses["length"] = pulse_samples
+            if residual:
+                pulses["length"][-1] = min(pulse_samples, residual)
+            chunks.append(pulses)
+        else:
+            chunks.append(np.array([(KIND_CODES[kind], pos, n)], dtype=TIMELINE_DTYPE))
+        pos += n
+
+    return np.concatenate(chunks)
+
+def timeline_paths(wav_path):
+    base = os.path.splitext(wav_path)[0]
+    return base + ".timeline.json", base + ".timeline.npy"
+
+def write_timeline(wav_path, events, sample_rate, settings=None):
+    json_path, npy_path = timeline_paths(wav_path)
+
+    np.save(npy_path, events)
+
+    def _sections(kind):
+        sel = events[events["kind"] == KIND_CODES[kind]]
+        return [{"start": int(s), "length": int(n)} for s, n in zip(sel["start"], sel["length"])]
+
+    last = events[-1]
+    manifest = {
+        "wav": os.path.basename(wav_path),
+        "sample_rate": int(sample_rate),
+        "total_samples": int(last["start"] + last["length"]),
+        "settings": settings or {},
+        "events_file": os.path.basename(npy_path),
+        "counts": {kind: int(np.count_nonzero(events["kind"] == code)) for kind, code in KIND_CODES.items()},
+        "beacons": _sections("beacon"),
+        "guards": _sections("guard"),
+        "silences": _sections("silence"),
+    }
+    with open(json_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return json_path, npy_path
+
+def load_timeline(path):
+    """
+    :param path: PROTOCOL WAV OR ITS .timeline.json
+    :return: (manifest dict, events structured array)
+    """
+    json_path = path if path.endswith(".timeline.json") else timeline_paths(path)[0]
+    with open(json_path) as f:
+        manifest = json.load(f)
+    events = np.load(os.path.join(os.path.dirname(json_path), manifest["events_file"]))
+    return manifest, events
+
+# ==========================================================
+# SEARCH WINDOWS FOR DECODERS
+# ==========================================================
+
+def events_of(events, kind):
+    return events[events["kind"] == KIND_CODES[kind]]
+
+def search_windows(events, offset, margin, n_total=None):
+    """
+    Merged [start, end) sample windows around events, shifted into recording
+    coordinates by 'offset' (protocol sample 0 -> recording sample 'offset').
+    """
+    starts = events["start"].astype(np.int64) + offset - margin
+    ends = events["start"].astype(np.int64) + events["length"] + offset + margin
+    starts = np.maximum(starts, 0)
+    if n_total is not None:
+        ends = np.minimum(ends, n_total)
+
+    windows = []
+    for s, e in zip(starts, ends):
+        if e <= s:
+            continue
+        if windows and s <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], int(e))
+        else:
+            windows.append([int(s), int(e)])
+    return [tuple(w) for w in windows]
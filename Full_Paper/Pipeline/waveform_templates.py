@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+
+# ==========================================================
+# WAVEFORM PRIMITIVES
+# ==========================================================
+
+def tone(freq, sec, sample_rate, amplitude):
+    t = np.arange(int(round(sec * sample_rate)), dtype=np.float32) / sample_rate
+    return (amplitude * np.sin(2.0 * np.pi * freq * t)).astype(np.float32)
+
+def chirp(start_freq, end_freq, sec, sample_rate, amplitude):
+    Ns = int(round(sample_rate * sec))
+    t = np.arange(Ns, dtype=np.float32) / sample_rate
+
+    k = (end_freq - start_freq) / sec # linear sweep rate (Hz/s)
+    phase = 2.0 * np.pi * (start_freq * t + 0.5 * k * t * t)
+    return (amplitude * np.sin(phase)).astype(np.float32)
+
+def apply_fade(x, fade_ms, sample_rate):
+    fade_samp = int(round(fade_ms * 1e-3 * sample_rate))
+    if fade_samp == 0 or 2 * fade_samp >= x.size:
+        return x
+    w = np.ones_like(x)
+    w[:fade_samp]  = np.linspace(0.0, 1.0, fade_samp, dtype=np.float32)
+    w[-fade_samp:] = np.linspace(1.0, 0.0, fade_samp, dtype=np.float32)
+    return x * w
+
+def quantize(x):
+    # float32 [-1, 1] -> int16 PCM
+    return np.rint(np.clip(x, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+def _read_only(x):
+    x.flags.writeable = False
+    return x
+
+# ==========================================================
+# TEMPLATE BANK (LRU)
+# ==========================================================
+
+@dataclass(frozen=True)
+class WaveformTemplate:
+    key: tuple              # (sample_rate, f0, f1, duration, amplitude, fade_ms)
+    samples: np.ndarray     # float32, faded, read-only
+    pcm: np.ndarray         # int16, read-only
+    fft: np.ndarray         # rfft of samples zero-padded to fft_size, read-only
+    fft_size: int
+
+    @property
+    def sample_rate(self):
+        return self.key[0]
+
+def _next_pow2(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+def _build_template(key):
+    sample_rate, f0, f1, duration, amplitude, fade_ms = key
+
+    # f0 == f1 -> plain tone (beacon), identical to the generator's tone()
+    if f0 == f1:
+        x = tone(f0, duration, sample_rate, amplitude)
+    else:
+        x = chirp(f0, f1, duration, sample_rate, amplitude)
+    x = apply_fade(x, fade_ms, sample_rate)
+
+    fft_size = _next_pow2(2 * x.size)
+    return WaveformTemplate(key=key,
+                            samples=_read_only(x),
+                            pcm=_read_only(quantize(x)),
+                            fft=_read_only(np.fft.rfft(x, n=fft_size)),
+                            fft_size=fft_size)
+
+class TemplateBank:
+    """
+    Memoized chirp/beacon templates keyed by
+    (sample_rate, f0, f1, duration, amplitude, fade_ms), least recently used
+    entries evicted past 'maxsize'. Arrays are shared and read-only.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = build()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def get(self, sample_rate, f0, f1, duration, amplitude, fade_ms):
+        key = (int(sample_rate), float(f0), float(f1), float(duration), float(amplitude), float(fade_ms))
+        return self._lookup(key, lambda: _build_template(key))
+
+    def spectrum(self, template, n_fft, conjugate=False):
+        # rfft of a template at another size (e.g. an overlap-save block), cached too
+        key = ("spectrum", template.key, int(n_fft), bool(conjugate))
+
+        def build():
+            X = np.fft.rfft(template.samples, n=n_fft)
+            return _read_only(np.conj(X) if conjugate else X)
+
+        return self._lookup(key, build)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+DEFAULT_BANK = TemplateBank()
+
+def get_template(sample_rate, f0, f1, duration, amplitude, fade_ms):
+    return DEFAULT_BANK.get(sample_rate, f0, f1, duration, amplitude, fade_ms)
+
+def get_spectrum(template, n_fft, conjugate=False):
+    return DEFAULT_BANK.spectrum(template, n_fft, conjugate)
+
+def chirp_template(spec):
+    # Chirp pulse of a ProtocolSpec (or anything with the same fields)
+    return get_template(spec.sample_rate, spec.start_freq, spec.end_freq,
+                        spec.pulse_duration, spec.amplitude, spec.fade_ms)
+
+def beacon_template(spec):
+    return get_template(spec.sample_rate, spec.beacon_freq, spec.beacon_freq,
+                        spec.beacon_duration_sec, spec.amplitude, spec.fade_ms)